@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from aiogram import Router, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.filters.command import Command, CommandObject
+
+import database.database as db
+import telegram_gateway
+
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+AUDIENCES = ('all', 'active')
+
+DELIVERED = 'delivered'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+
+class Broadcaster:
+    # Рассылка идёт порциями получателей (keyset-запрос на порцию); порция отправляется
+    # пулом из concurrency воркеров (темп задаёт TelegramGateway, полоса BULK),
+    # после порции прогресс сохраняется в broadcasts. После рестарта рассылка
+    # продолжается с last_user_id, повторно может уйти не больше одной порции.
+    # Каждую рассылку ведёт один воркер: он берёт её атомарно (db.claim_broadcast)
+    # и продлевает аренду heartbeat'ом; чужую рассылку подхватывают, только когда
+    # её аренда истекла. Отмена пишется в БД и останавливает рассылку в любом воркере.
+    # Сбой БД повторяется с задержкой; если повторы не помогли, рассылка помечается
+    # failed, а администратор получает отчёт.
+
+    def __init__(self, bot, concurrency=16, chunk_size=500, lease=timedelta(minutes=2), max_attempts=6):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = {}  # broadcast_id -> asyncio.Task
+
+    def start(self, broadcast_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume(self):
+        for broadcast in await db.get_running_broadcasts():
+            self.start(broadcast.id)
+
+    async def run(self):
+        # Подхватываем рассылки, прерванные рестартом или брошенные упавшим воркером
+        while True:
+            try:
+                await self.resume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Broadcast resume failed: %s", e)
+            await asyncio.sleep(self.lease.total_seconds())
+
+    async def cancel(self, broadcast_id):
+        task = self._tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+        await db.finish_broadcast(broadcast_id, 'cancelled')
+
+    async def close(self):
+        # Рассылки остаются в статусе running и продолжатся в другом воркере или при следующем старте
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        try:
+            await db.release_broadcasts(self.runner_id)
+        except Exception as e:
+            logger.warning("Failed to release broadcasts: %s", e)
+
+    async def _heartbeat(self, broadcast_id, runner):
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 4)
+            try:
+                alive = await db.heartbeat_broadcast(broadcast_id, self.runner_id)
+            except Exception as e:
+                logger.warning("Broadcast %d heartbeat failed: %s", broadcast_id, e)
+                continue
+            if not alive:
+                logger.info("Broadcast %d was cancelled or taken over, stopping", broadcast_id)
+                runner.cancel()
+                return
+
+    async def _retry(self, broadcast_id, step, *args):
+        # Временные сбои (БД, сеть) повторяем с задержкой; после max_attempts - ошибка наружу
+        backoff = 1
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await step(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning("Broadcast %d: %s failed (attempt %d), retrying in %d s: %s",
+                               broadcast_id, step.__name__, attempt, backoff, e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    async def _run(self, broadcast_id):
+        broadcast = await db.claim_broadcast(broadcast_id, self.runner_id, self.lease)
+        if broadcast is None:
+            # Рассылку ведёт другой живой воркер (или она уже завершена)
+            return
+        logger.info("Running broadcast %d from user %s", broadcast.id, broadcast.last_user_id)
+        heartbeat = asyncio.create_task(self._heartbeat(broadcast.id, asyncio.current_task()))
+        try:
+            with telegram_gateway.lane(telegram_gateway.BULK):
+                try:
+                    last_user_id = broadcast.last_user_id
+                    while True:
+                        chunk = await self._retry(broadcast.id, db.fetch_broadcast_recipients, broadcast.audience,
+                                                  last_user_id, self.chunk_size)
+                        if not chunk:
+                            break
+                        counts = await self._send_chunk(broadcast, chunk)
+                        last_user_id = chunk[-1]
+                        if not await self._retry(broadcast.id, db.checkpoint_broadcast, broadcast.id, self.runner_id,
+                                                 last_user_id, counts[DELIVERED], counts[BLOCKED], counts[FAILED]):
+                            logger.info("Broadcast %d is no longer ours, stopping", broadcast.id)
+                            return
+                    await self._retry(broadcast.id, db.finish_broadcast, broadcast.id, 'done')
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Повторы не помогли - помечаем рассылку неудачной, чтобы она не висела в running
+                    logger.error("Broadcast %d failed: %s", broadcast.id, e)
+                    try:
+                        await db.finish_broadcast(broadcast.id, 'failed')
+                    except Exception as e:
+                        logger.warning("Failed to mark broadcast %d as failed: %s", broadcast.id, e)
+        finally:
+            heartbeat.cancel()
+
+        if broadcast.notify_chat_id is not None:
+            try:
+                result = await db.get_broadcast(broadcast.id)
+                await self.bot.send_message(broadcast.notify_chat_id, broadcast_report(result))
+            except Exception as e:
+                logger.warning("Failed to send broadcast %d report: %s", broadcast.id, e)
+
+    async def _send_chunk(self, broadcast, user_ids):
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+        counts = {DELIVERED: 0, BLOCKED: 0, FAILED: 0}
+
+        async def worker():
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                counts[await self._send(broadcast, user_id)] += 1
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(user_ids)))))
+        return counts
+
+    async def _send(self, broadcast, user_id):
+        try:
+            if broadcast.message_id is not None:
+                await self.bot.copy_message(user_id, broadcast.from_chat_id, broadcast.message_id)
+            else:
+                await self.bot.send_message(user_id, broadcast.text, parse_mode="HTML")
+            return DELIVERED
+        except TelegramForbiddenError:
+            # Бот заблокирован пользователем или пользователь удалён
+            return BLOCKED
+        except TelegramBadRequest as e:
+            logger.info("Broadcast %d to %s failed: %s", broadcast.id, user_id, e)
+            return FAILED
+        except Exception as e:
+            logger.warning("Broadcast %d to %s failed: %s", broadcast.id, user_id, e)
+            return FAILED
+
+
+def broadcast_report(broadcast):
+    return (f"Broadcast #{broadcast.id} ({broadcast.audience}): {broadcast.status}\n"
+            f"Delivered: {broadcast.delivered}, blocked: {broadcast.blocked}, failed: {broadcast.failed}")
+
+
+def _is_admin(message: types.Message):
+    return message.from_user.id == int(os.getenv("Acc_id"))  # Ваш личный user_id
+
+
+@router.message(Command("broadcast"))
+async def start_broadcast(message: types.Message, command: CommandObject, ctx):
+    if not _is_admin(message):
+        await message.reply("You are not authorized to use this command.")
+        return
+
+    # /broadcast [all|active] текст, либо ответом на сообщение, которое нужно разослать
+    args = (command.args or '').split(maxsplit=1)
+    audience = 'all'
+    if args and args[0] in AUDIENCES:
+        audience = args.pop(0)
+    text = args[0] if args else None
+    source = message.reply_to_message
+    if source is None and not text:
+        await message.reply("Usage: /broadcast [all|active] <text>, or reply to a message with /broadcast [all|active].")
+        return
+
+    if source is None:
+        # Текст уходит с parse_mode=HTML: проверяем разметку один раз превью администратору,
+        # иначе лишний "<" или "&" провалил бы отправку каждому получателю
+        try:
+            await message.answer(text, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            await message.reply(f"Can't send this text as HTML, broadcast not started: {e.message}")
+            return
+
+    runner_id = ctx.broadcaster.runner_id
+    if source is not None:
+        broadcast = await db.create_broadcast(audience, from_chat_id=source.chat.id, message_id=source.message_id,
+                                              runner_id=runner_id, notify_chat_id=message.chat.id)
+    else:
+        broadcast = await db.create_broadcast(audience, text=text, runner_id=runner_id,
+                                              notify_chat_id=message.chat.id)
+    ctx.broadcaster.start(broadcast.id)
+    await message.reply(f"Broadcast #{broadcast.id} to {audience} users started. "
+                        f"Check progress with /broadcast_status {broadcast.id}.")
+
+
+@router.message(Command("broadcast_status"))
+async def broadcast_status(message: types.Message, command: CommandObject):
+    if not _is_admin(message):
+        await message.reply("You are not authorized to use this command.")
+        return
+    try:
+        broadcast = await db.get_broadcast(int(command.args))
+    except (TypeError, ValueError):
+        await message.reply("Please provide the broadcast id.")
+        return
+    if broadcast is None:
+        await message.reply("Broadcast not found.")
+        return
+    await message.reply(broadcast_report(broadcast))
+
+
+@router.message(Command("broadcast_cancel"))
+async def broadcast_cancel(message: types.Message, command: CommandObject, ctx):
+    if not _is_admin(message):
+        await message.reply("You are not authorized to use this command.")
+        return
+    try:
+        broadcast_id = int(command.args)
+    except (TypeError, ValueError):
+        await message.reply("Please provide the broadcast id.")
+        return
+    await ctx.broadcaster.cancel(broadcast_id)
+    await message.reply(f"Broadcast #{broadcast_id} cancelled.")
@@ -0,0 +1,165 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+
+from aiogram import Router, types
+from aiogram.filters.command import Command, CommandObject
+from aiogram.types import FSInputFile
+
+import database.database as db
+import telegram_gateway
+
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+IMPORT_CHUNK_SIZE = 500
+MAX_MONTHS = 120
+
+_imports = set()  # ссылки на фоновые задачи импорта, чтобы их не собрал GC
+
+
+def _is_admin(message: types.Message):
+    return message.from_user.id == int(os.getenv("Acc_id"))  # Ваш личный user_id
+
+
+def parse_grants(content: bytes, filename: str = ''):
+    # CSV (user_id,months; заголовок необязателен) или JSON: [{"user_id":..,"months":..}] / [[user_id, months]].
+    # Повторы одного user_id складываются. Возвращает ({user_id: months}, номера строк с ошибками):
+    # для CSV - строка файла, для JSON - номер элемента массива
+    text = content.decode('utf-8-sig')
+    if filename.lower().endswith('.json') or text.lstrip().startswith('['):
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("JSON must be a list of records")
+        records = []
+        for line, item in enumerate(items, 1):
+            if isinstance(item, dict):
+                records.append((line, (item.get('user_id'), item.get('months'))))
+            else:
+                records.append((line, tuple(item[:2]) if isinstance(item, list) else (item, None)))
+    else:
+        records = [(line, tuple(row[:2])) for line, row in enumerate(csv.reader(io.StringIO(text)), 1) if row]
+        if records and not str(records[0][1][0]).strip().lstrip('-').isdigit():
+            records = records[1:]  # заголовок
+
+    grants = {}
+    errors = []
+    for line, record in records:
+        try:
+            user_id, months = int(str(record[0]).strip()), int(str(record[1]).strip())
+            if user_id <= 0 or not 0 < months <= MAX_MONTHS:
+                raise ValueError
+        except (IndexError, TypeError, ValueError):
+            errors.append(line)
+            continue
+        grants[user_id] = grants.get(user_id, 0) + months
+    return grants, errors
+
+
+async def _deliver_links(bot, user_ids, concurrency=8):
+    # Ссылки уходят пулом воркеров в полосе BULK: темп держит TelegramGateway
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            try:
+                invite_link = await db.issue_invite_link(user_id)
+                await bot.send_message(user_id, f"Your link to the channel: {invite_link}.")
+            except Exception as e:
+                failed += 1
+                logger.info("Failed to send invite link to %s: %s", user_id, e)
+
+    with telegram_gateway.lane(telegram_gateway.BULK):
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(user_ids)))))
+    return failed
+
+
+async def _import(message: types.Message, grants: dict, send_links: bool):
+    granted = 0
+    link_failures = 0
+    items = list(grants.items())
+    for chunk, start in enumerate(range(0, len(items), IMPORT_CHUNK_SIZE)):
+        try:
+            rows = await db.grant_subscriptions(items[start:start + IMPORT_CHUNK_SIZE])
+        except Exception as e:
+            # Порции до этой уже записаны: повторять нужно только оставшихся пользователей,
+            # иначе уже импортированные получат продление дважды
+            logger.warning("Subscription import stopped at user %d of %d: %s", start + 1, len(items), e)
+            await message.answer(
+                f"Import stopped with an error: {e}\n"
+                f"Chunks done: {chunk}, {granted} subscription(s) granted or extended. "
+                f"Stopped at user #{start + 1} of {len(items)} (user_id {items[start][0]}); "
+                f"users from there on were not imported."
+            )
+            return
+        granted += len(rows)
+        if send_links:
+            link_failures += await _deliver_links(message.bot, [row.user_id for row in rows])
+    report = f"Import finished: {granted} subscription(s) granted or extended."
+    if send_links:
+        report += f" Invite links failed for {link_failures} user(s)."
+    await message.answer(report)
+
+
+@router.message(Command("import_subscriptions"))
+async def import_subscriptions(message: types.Message, command: CommandObject):
+    if not _is_admin(message):
+        await message.reply("You are not authorized to use this command.")
+        return
+
+    # Файл прикладывается к команде (подпись) или команда отправляется ответом на файл
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if document is None:
+        await message.reply("Attach a CSV (user_id,months) or JSON file. Add 'silent' to skip sending invite links.")
+        return
+
+    buffer = io.BytesIO()
+    await message.bot.download(document, destination=buffer)
+    try:
+        grants, errors = parse_grants(buffer.getvalue(), document.file_name or '')
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        await message.reply(f"Can't parse the file: {e}")
+        return
+    if not grants:
+        await message.reply("No valid rows found.")
+        return
+
+    send_links = (command.args or '').strip().lower() != 'silent'
+    skipped = f" Skipped invalid rows: {', '.join(map(str, errors[:20]))}{'...' if len(errors) > 20 else ''}." if errors else ""
+    await message.reply(f"Importing {len(grants)} user(s).{skipped}")
+    # Импорт и рассылка ссылок идут в фоне, хэндлер не держит апдейт
+    task = asyncio.create_task(_import(message, grants, send_links))
+    _imports.add(task)
+    task.add_done_callback(_imports.discard)
+
+
+@router.message(Command("export_subscriptions"))
+async def export_subscriptions(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("You are not authorized to use this command.")
+        return
+
+    fd, path = tempfile.mkstemp(prefix='subscriptions_', suffix='.csv')
+    try:
+        exported = 0
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['user_id', 'subscription_start', 'subscription_end'])
+            async for row in db.stream_subscriptions():
+                writer.writerow([row.user_id, row.subscription_start.isoformat(), row.subscription_end.isoformat()])
+                exported += 1
+        await message.answer_document(FSInputFile(path, filename='subscriptions.csv'),
+                                      caption=f"{exported} subscription(s)")
+    finally:
+        os.remove(path)
@@ -0,0 +1,51 @@
+import inspect
+import logging
+
+from aiogram import Router
+from aiogram.types import CallbackQuery
+
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackDispatcher:
+    # Один хэндлер callback_query на все кнопки: префикс callback_data и action
+    # разрешаются поиском в словаре, а не перебором фильтров F.data == ...
+
+    def __init__(self):
+        self.router = Router()
+        self._factories = {}  # prefix -> CallbackData class
+        self._handlers = {}  # (prefix, action) -> (handler, имена доп. аргументов)
+        self.router.callback_query.register(self._dispatch)
+
+    def handler(self, factory, *actions):
+        def decorator(func):
+            params = set(inspect.signature(func).parameters) - {'callback', 'callback_data'}
+            self._factories[factory.__prefix__] = factory
+            for action in actions:
+                self._handlers[(factory.__prefix__, action)] = (func, params)
+            return func
+        return decorator
+
+    async def _dispatch(self, callback: CallbackQuery, **kwargs):
+        prefix = (callback.data or '').split(':', 1)[0]
+        factory = self._factories.get(prefix)
+        if factory is None:
+            # Кнопка из старого сообщения (до структурированных callback_data)
+            await callback.answer('This menu is outdated. Please open it again.')
+            return
+        try:
+            callback_data = factory.unpack(callback.data)
+        except (TypeError, ValueError) as e:
+            logger.warning("Bad callback data %r: %s", callback.data, e)
+            await callback.answer('')
+            return
+        entry = self._handlers.get((prefix, callback_data.action))
+        if entry is None:
+            await callback.answer('')
+            return
+        handler, params = entry
+        return await handler(callback, callback_data, **{name: kwargs[name] for name in params if name in kwargs})
+
+
+callback_dispatcher = CallbackDispatcher()
@@ -0,0 +1,107 @@
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class Settings:
+    token: str
+    database_url: str
+    channel_id: int
+    cmc_api_key: str = None
+    rate_refresh_interval: float = 300  # секунд между фоновыми запросами к CMC
+    okx_api_key: str = None
+    okx_secret_key: str = None
+    okx_passphrase: str = None
+    okx_uid: str = "429658822286951495"
+    # Пул соединений БД
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 500  # подготовленные выражения asyncpg на соединение
+    db_echo: bool = False
+    db_slow_query_ms: float = 200
+    # Исходящие запросы к Telegram: общий темп и темп отправки в один чат (в секунду)
+    telegram_rate: float = 25
+    telegram_chat_rate: float = 1
+    # Запас одноразовых ссылок в канал (0 - создавать ссылку при каждой выдаче)
+    invite_pool_size: int = 10
+    invite_pool_low_water: int = 3
+    invite_link_ttl_hours: float = 168
+    invite_link_min_remaining_hours: float = 24
+    # Метрики Prometheus: http://metrics_host:metrics_port/metrics, порт 0 - выключено
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    # Webhook: если WEBHOOK_URL не задан, бот работает через long polling
+    webhook_url: str = None
+    webhook_path: str = "/webhook"
+    webhook_secret: str = None
+    webhook_set: bool = True
+    webhook_max_concurrency: int = 64
+    webapp_host: str = "127.0.0.1"
+    webapp_port: int = 8080
+    webapp_reuse_port: bool = False
+    # FSM: "sql" (общая для воркеров, переживает рестарт) или "memory"
+    fsm_storage: str = "sql"
+    # Кэш FSM в памяти процесса, секунды; при WEBAPP_REUSE_PORT выключается
+    fsm_cache_ttl: float = 30
+    # Фоновые задачи (OKX, планировщик) достаточно запускать в одном воркере
+    background_jobs: bool = True
+
+    def __post_init__(self):
+        # Без секрета любой, кто знает URL, может слать боту поддельные апдейты
+        if self.webhook_url and not self.webhook_secret:
+            raise ValueError("WEBHOOK_SECRET must be set when WEBHOOK_URL is used")
+
+    @classmethod
+    def from_env(cls):
+        # Загружаем переменные из .env файла
+        load_dotenv()
+        return cls(
+            token=os.getenv("TOKEN"),
+            database_url=os.getenv("DATABASE_URL"),
+            channel_id=int(os.getenv("CHANNEL_ID", "0")),
+            cmc_api_key=os.getenv("CMC_api_key"),
+            rate_refresh_interval=float(os.getenv("RATE_REFRESH_INTERVAL", "300")),
+            okx_api_key=os.getenv("OKX_api_key"),
+            okx_secret_key=os.getenv("OKX_secret_key"),
+            okx_passphrase=os.getenv("OKX_passphrase"),
+            okx_uid=os.getenv("OKX_uid", "429658822286951495"),
+            db_pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            db_pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            db_pool_pre_ping=_env_flag("DB_POOL_PRE_PING", True),
+            db_statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500")),
+            db_echo=_env_flag("DB_ECHO", False),
+            db_slow_query_ms=float(os.getenv("DB_SLOW_QUERY_MS", "200")),
+            telegram_rate=float(os.getenv("TELEGRAM_RATE", "25")),
+            telegram_chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+            invite_pool_size=int(os.getenv("INVITE_POOL_SIZE", "10")),
+            invite_pool_low_water=int(os.getenv("INVITE_POOL_LOW_WATER", "3")),
+            invite_link_ttl_hours=float(os.getenv("INVITE_LINK_TTL_HOURS", "168")),
+            invite_link_min_remaining_hours=float(os.getenv("INVITE_LINK_MIN_REMAINING_HOURS", "24")),
+            metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            metrics_port=int(os.getenv("METRICS_PORT", "0")),
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            webhook_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            webhook_secret=os.getenv("WEBHOOK_SECRET"),
+            webhook_set=_env_flag("WEBHOOK_SET", True),
+            webhook_max_concurrency=int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64")),
+            webapp_host=os.getenv("WEBAPP_HOST", "127.0.0.1"),
+            webapp_port=int(os.getenv("WEBAPP_PORT", "8080")),
+            webapp_reuse_port=_env_flag("WEBAPP_REUSE_PORT", False),
+            fsm_storage=os.getenv("FSM_STORAGE", "sql"),
+            fsm_cache_ttl=float(os.getenv("FSM_CACHE_TTL", "30")),
+            background_jobs=_env_flag("BACKGROUND_JOBS", True),
+        )
@@ -0,0 +1,187 @@
+from datetime import timedelta
+import logging
+
+import database.database as db
+import templates
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+
+from broadcast import Broadcaster
+from database.fsm_storage import SQLAlchemyStorage
+from database.instrumentation import DBStats
+from expiry import ExpiryScheduler
+from invites import InviteLinkPool
+from okx import OKXDepositStream
+from rates import RateService
+from registrar import UserRegistrar
+from settlement import SettlementWatcher
+from telegram_gateway import TelegramGateway
+
+
+class AppContext:
+    # Все тяжёлые объекты (Bot, движок БД, сессии, клиент курсов) создаются
+    # лениво при первом обращении, а не при импорте модулей.
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._bot = None
+        self.telegram = None
+        self._dispatcher = None
+        self._engine = None
+        self._session_factory = None
+        self._rates = None
+        self._okx = None
+        self._settlement = None
+        self._invites = None
+        self._broadcaster = None
+        self.expiry = ExpiryScheduler()
+        self.registrar = UserRegistrar()
+        self.db_stats = DBStats(slow_query_ms=settings.db_slow_query_ms)
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            self._bot = Bot(token=self.settings.token)
+            # Первая middleware сессии - внешняя: темп и RetryAfter для всех запросов бота
+            self.telegram = TelegramGateway(
+                rate=self.settings.telegram_rate,
+                burst=self.settings.telegram_rate,
+                chat_rate=self.settings.telegram_chat_rate,
+            )
+            self._bot.session.middleware(self.telegram)
+        return self._bot
+
+    @property
+    def dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = Dispatcher(storage=self._create_storage())
+            # Контекст доступен в хэндлерах как аргумент ctx
+            self._dispatcher["ctx"] = self
+        return self._dispatcher
+
+    def _create_storage(self):
+        if self.settings.fsm_storage == "memory":
+            return MemoryStorage()
+        cache_ttl = self.settings.fsm_cache_ttl
+        if self.settings.webapp_reuse_port and cache_ttl > 0:
+            # При SO_REUSEPORT апдейты одного чата попадают в разные воркеры -
+            # состояние читается из БД по первичному ключу
+            logging.info("FSM cache disabled: several webhook workers share the port")
+            cache_ttl = 0
+        return SQLAlchemyStorage(self.session_factory, cache_ttl=cache_ttl)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            settings = self.settings
+            connect_args = {}
+            if settings.database_url.startswith("postgresql+asyncpg"):
+                connect_args["prepared_statement_cache_size"] = settings.db_statement_cache_size
+            self._engine = create_async_engine(
+                settings.database_url,
+                echo=settings.db_echo,
+                pool_size=settings.db_pool_size,
+                max_overflow=settings.db_max_overflow,
+                pool_timeout=settings.db_pool_timeout,
+                pool_recycle=settings.db_pool_recycle,
+                pool_pre_ping=settings.db_pool_pre_ping,
+                connect_args=connect_args,
+            )
+            self.db_stats.install(self._engine)
+        return self._engine
+
+    @property
+    def session_factory(self):
+        if self._session_factory is None:
+            self._session_factory = async_sessionmaker(bind=self.engine, expire_on_commit=False, class_=AsyncSession)
+        return self._session_factory
+
+    @property
+    def rates(self):
+        if self._rates is None:
+            self._rates = RateService(
+                self.settings.cmc_api_key,
+                refresh_interval=self.settings.rate_refresh_interval,
+                on_snapshot=db.record_rates,
+                history=db.get_latest_rate,
+            )
+        return self._rates
+
+    @property
+    def okx(self):
+        if self._okx is None:
+            self._okx = OKXDepositStream(
+                self.settings.okx_api_key,
+                self.settings.okx_secret_key,
+                self.settings.okx_passphrase,
+                self.settings.okx_uid,
+                on_deposits=self._ingest_deposits,
+            )
+        return self._okx
+
+    @property
+    def settlement(self):
+        if self._settlement is None:
+            self._settlement = SettlementWatcher(self.bot)
+        return self._settlement
+
+    async def _ingest_deposits(self, deposits):
+        await db.store_deposits(deposits)
+        await self.settlement.on_deposits(deposits)
+
+    @property
+    def invites(self):
+        if self._invites is None and self.settings.invite_pool_size > 0:
+            self._invites = InviteLinkPool(
+                self.bot,
+                self.settings.channel_id,
+                size=self.settings.invite_pool_size,
+                low_water=self.settings.invite_pool_low_water,
+                ttl=timedelta(hours=self.settings.invite_link_ttl_hours),
+                min_remaining=timedelta(hours=self.settings.invite_link_min_remaining_hours),
+            )
+        return self._invites
+
+    @property
+    def broadcaster(self):
+        if self._broadcaster is None:
+            self._broadcaster = Broadcaster(self.bot)
+        return self._broadcaster
+
+    async def start(self):
+        # Тексты экранов разбираются и проверяются один раз при старте
+        templates.load_templates()
+        db.setup(
+            telegram_bot=self.bot,
+            db_engine=self.engine,
+            session_factory=self.session_factory,
+            channel_id=self.settings.channel_id,
+            invite_links=self.invites,
+        )
+        await db.init_models()
+        db.subscription_listeners.append(self.expiry.notify)
+        await db.load_pending_payments()
+        # Курсы обновляет и пишет в историю только воркер с фоновыми задачами
+        await self.rates.start(refresh=self.settings.background_jobs)
+        await self.registrar.start()
+        if self.invites is not None:
+            await self.invites.start()
+
+    async def close(self):
+        # До закрытия движка: дописываем накопленных пользователей
+        await self.registrar.close()
+        if self._broadcaster is not None:
+            await self._broadcaster.close()
+        if self._invites is not None:
+            # Отзываем невыданные ссылки, пока бот и БД ещё открыты
+            await self._invites.close()
+        if self._rates is not None:
+            await self._rates.close()
+        if self._dispatcher is not None:
+            await self._dispatcher.storage.close()
+        if self._bot is not None:
+            await self._bot.session.close()
+        if self._engine is not None:
+            await self._engine.dispose()
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    # LRU-кэш с TTL на запись. None тоже кэшируется ("нет данных"), но на
+    # отдельный, обычно более короткий, negative_ttl.
+
+    def __init__(self, maxsize=10000, ttl=60, negative_ttl=15):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data = OrderedDict()  # key -> (value, monotonic deadline)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=_MISSING):
+        # Возвращает default (по умолчанию MISSING), если записи нет или она устарела
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+MISSING = _MISSING
@@ -1,28 +1,103 @@
-import main as m
 import asyncio
+import math
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone, time
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, DateTime, String, BigInteger, Float, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, String, BigInteger, Boolean, Float, ForeignKey, Index, JSON, CheckConstraint, Numeric, cast
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy import select
+from sqlalchemy import delete, tuple_, update
+from sqlalchemy import Interval, func, literal, literal_column
 from sqlalchemy import text
 from sqlalchemy.orm import relationship
-from dotenv import load_dotenv
-import os
 
-load_dotenv()
+from database import migrations
+from database.cache import MISSING, TTLCache
+from database.pending import PendingPayment, PendingPaymentIndex
+from plans import PLANS
+import telegram_gateway
 
 
-# Создание базы данных
-DATABASE_URL = os.getenv("DATABASE_URL")
-# Создаем асинхронный движок
-engine = create_async_engine(DATABASE_URL, echo=True)
-# Создаем асинхронную сессию
-async_session = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+# Движок, фабрика сессий и бот передаются из AppContext через setup(),
+# поэтому модуль можно импортировать без сети и без настроенной БД
+engine = None
+async_session = None
+bot = None
+CHANNEL_ID = None
+invite_pool = None
 # Создаем базовый класс для моделей
 Base = declarative_base()
 
-CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
+
+# Подписчики на изменения подписок: callback(user_id, subscription_end | None).
+# Вызываются после коммита (планировщик истечения, кэши)
+subscription_listeners = []
+
+# Живые ожидающие платежи этого процесса (горячий путь без запросов к pay_info)
+pending_payments = PendingPaymentIndex()
+
+
+# (subscription_start, subscription_end) | None по user_id для экрана "My subscription".
+# Сбрасывается в notify_subscription_changed, чужие воркеры догоняют по TTL
+subscription_cache = TTLCache(maxsize=50000, ttl=60, negative_ttl=15)
+
+
+def notify_subscription_changed(user_id: int, subscription_end: datetime = None):
+    subscription_cache.invalidate(user_id)
+    for listener in subscription_listeners:
+        try:
+            listener(user_id, subscription_end)
+        except Exception as e:
+            print(f"Subscription listener error: {e}")
+
+
+def setup(telegram_bot, db_engine, session_factory, channel_id, invite_links=None):
+    global bot, engine, async_session, CHANNEL_ID, invite_pool
+    bot = telegram_bot
+    engine = db_engine
+    async_session = session_factory
+    CHANNEL_ID = channel_id
+    invite_pool = invite_links
+
+
+async def issue_invite_link(user_id: int):
+    # Ссылка в канал для user_id: из пула заранее созданных ссылок, если он есть
+    if invite_pool is not None:
+        return await invite_pool.take(user_id)
+    with telegram_gateway.lane(telegram_gateway.PAYMENT):
+        result = await bot.create_chat_invite_link(CHANNEL_ID, member_limit=1)
+    return result.invite_link
+
+
+async def record_invite_links(links):
+    now = datetime.now(timezone.utc)
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(InviteLink),
+                [{'invite_link': link, 'created_at': now, 'expires_at': expires_at} for link, expires_at in links]
+            )
+
+
+async def mark_invites_issued(issued):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(InviteLink),
+                [{'invite_link': link, 'user_id': user_id, 'issued_at': issued_at} for link, user_id, issued_at in issued]
+            )
+
+
+async def mark_invites_revoked(links):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(InviteLink)
+                .where(InviteLink.invite_link.in_(links))
+                .values(revoked_at=datetime.now(timezone.utc))
+            )
 
 # Модель для таблицы пользователей
 class UserSubscription(Base):
@@ -30,8 +105,7 @@ class UserSubscription(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, unique=True, nullable=False)
     subscription_start = Column(DateTime(timezone=True), nullable=False)
-    subscription_end = Column(DateTime(timezone=True), nullable=False)
-
+    subscription_end = Column(DateTime(timezone=True), nullable=False, index=True)
 
 
 class PaymentInfo(Base):
@@ -46,6 +120,15 @@ class PaymentInfo(Base):
     transaction_hash = Column(String(255), unique=True)
     ccy = Column(String)
 
+    __table_args__ = (
+        # Последний платёж пользователя (cancel, verify_and_settle при промахе индекса)
+        Index('ix_pay_info_user_id_id', 'user_id', id.desc()),
+        # Массовое истечение ожидающих платежей
+        Index('ix_pay_info_status_window_end', 'status', 'payment_window_end'),
+        # Хэша ещё нет - NULL, а не "" (иначе unique не даёт создать второй платёж)
+        CheckConstraint("transaction_hash <> ''", name='ck_pay_info_transaction_hash_not_empty'),
+    )
+
     def __repr__(self):
         return f"<PaymentInfo(user_id={self.user_id}, crypto_amount={self.crypto_amount}, crypto_rate={self.crypto_rate}, status={self.status})>"
 
@@ -62,6 +145,9 @@ class Deposit(Base):
 
     user = relationship("UserTrack", back_populates="deposits")
 
+    __table_args__ = (
+        Index('ix_deposits_user_id_id', 'user_id', id.desc()),
+    )
 
 
 class UserTrack(Base):
@@ -73,355 +159,648 @@ class UserTrack(Base):
     deposits = relationship("Deposit", back_populates="user")
 
 
-async def scheduler():
-    while True:
-        await remove_expired_users()
-        await asyncio.sleep(21600)
+# История курсов: одна строка на символ за каждый batched-запрос к CMC
+class RateHistory(Base):
+    __tablename__ = 'rate_history'
 
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    symbol = Column(String(10), nullable=False)
+    rate = Column(Float, nullable=False)  # Курс в USDT
+    fetched_at = Column(DateTime(timezone=True), nullable=False)
 
+    __table_args__ = (
+        Index('ix_rate_history_symbol_fetched_at', 'symbol', fetched_at.desc()),
+    )
 
-# Asynchronous function to remove expired users
-async def remove_expired_users():
-    # Create a new async session
+
+# Состояния FSM (aiogram), переживают рестарт и общие для всех воркеров
+class FSMRecord(Base):
+    __tablename__ = 'fsm_storage'
+
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255), nullable=True)
+    data = Column(JSON, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+# Одноразовые ссылки в канал из InviteLinkPool: кому и когда выдана
+class InviteLink(Base):
+    __tablename__ = 'invite_links'
+
+    invite_link = Column(String(255), primary_key=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    user_id = Column(BigInteger, nullable=True, index=True)
+    issued_at = Column(DateTime(timezone=True), nullable=True)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# Рассылки администратора; last_user_id - точка продолжения после рестарта
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    audience = Column(String(20), nullable=False)  # 'all' (user_track) или 'active' (users)
+    from_chat_id = Column(BigInteger, nullable=True)  # копируемое сообщение, если рассылка ответом
+    message_id = Column(BigInteger, nullable=True)
+    text = Column(String, nullable=True)
+    status = Column(String(20), nullable=False, default='running')  # running, done, cancelled, failed
+    last_user_id = Column(BigInteger, nullable=True)
+    delivered = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # Аренда: рассылку ведёт воркер runner_id, пока обновляет heartbeat_at
+    runner_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    notify_chat_id = Column(BigInteger, nullable=True)  # куда отправить отчёт по завершении
+
+
+# Хэши, присланные пользователем до зачисления депозита: SettlementWatcher засчитает
+# депозит этому пользователю, когда OKX сообщит о зачислении (любой воркер видит заявку)
+class DepositClaim(Base):
+    __tablename__ = 'deposit_claims'
+
+    tx_hash = Column(String(255), primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    with_payment = Column(Boolean, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+# Знаков после запятой в сумме платежа, которую видит пользователь
+AMOUNT_DECIMALS = 8
+
+# Курс старше этого считаем недействительным для новых платежей
+RATE_MAX_AGE = timedelta(minutes=15)
+
+
+async def init_models():
+    # Схема версионируется в database/migrations.py (таблица schema_version)
+    await migrations.migrate(engine)
+
+
+async def record_rates(rates: dict, fetched_at: datetime):
+    if not rates:
+        return
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(RateHistory),
+                [{'symbol': symbol, 'rate': rate, 'fetched_at': fetched_at} for symbol, rate in rates.items()]
+            )
+
+
+async def prune_rate_history(keep: timedelta = timedelta(days=30)):
     async with async_session() as session:
-        # Get current date and time
-        current_time = datetime.now(timezone.utc)
+        async with session.begin():
+            result = await session.execute(
+                delete(RateHistory).where(RateHistory.fetched_at < datetime.now(timezone.utc) - keep)
+            )
+    return result.rowcount
 
-        # Query the database for users whose subscription has expired
-        result = await session.execute(
-            select(UserSubscription).where(UserSubscription.subscription_end < current_time)
-        )
-        expired_users = result.scalars().all()
 
-        # Loop through expired users and remove them from the channel
-        for user in expired_users:
+async def run_rate_history_retention(interval: int = 3600, keep: timedelta = timedelta(days=30)):
+    while True:
+        try:
+            pruned = await prune_rate_history(keep)
+            if pruned:
+                print(f"Pruned {pruned} old rate history rows")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Rate history retention error: {e}")
+        await asyncio.sleep(interval)
+
+
+async def get_latest_rate(symbol: str, session: AsyncSession = None):
+    # Последний сохранённый курс (или None, если он отсутствует/устарел)
+    query = (
+        select(RateHistory.rate, RateHistory.fetched_at)
+        .where(RateHistory.symbol == symbol)
+        .order_by(RateHistory.fetched_at.desc())
+        .limit(1)
+    )
+    if session is None:
+        async with async_session() as session:
+            row = (await session.execute(query)).first()
+    else:
+        row = (await session.execute(query)).first()
+    if row is None or datetime.now(timezone.utc) - row.fetched_at > RATE_MAX_AGE:
+        return None
+    return row.rate
+
+
+async def _kick_users(user_ids: list, concurrency: int):
+    # Удаляем пользователей из канала пулом воркеров, возвращаем успешно удалённых.
+    # Темп и RetryAfter - на стороне TelegramGateway, полоса BULK пропускает оплаты вперёд
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+    kicked = []
+
+    async def worker():
+        while not queue.empty():
+            user_id = queue.get_nowait()
             try:
-                print(f"Removing user {user.user_id} from the channel...")
-                await m.bot.ban_chat_member(CHANNEL_ID, user.user_id)
-                await m.bot.unban_chat_member(CHANNEL_ID, user.user_id)
-                # Optionally, delete the user from the database after removal
-                await session.delete(user)
-                await session.commit()
+                print(f"Removing user {user_id} from the channel...")
+                await bot.ban_chat_member(CHANNEL_ID, user_id)
+                await bot.unban_chat_member(CHANNEL_ID, user_id)
+                kicked.append(user_id)
             except Exception as e:
-                print(f"Error removing user {user.user_id}: {e}")
+                print(f"Error removing user {user_id}: {e}")
+
+    with telegram_gateway.lane(telegram_gateway.BULK):
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(user_ids)))))
+    return kicked
 
 
+# Asynchronous function to remove expired users
+async def remove_expired_users(chunk_size: int = 500, concurrency: int = 8):
+    # Просроченные подписки читаются порциями по индексу subscription_end (keyset-пагинация),
+    # каждая порция удаляется из канала пулом воркеров и из БД одним DELETE
+    current_time = datetime.now(timezone.utc)
+    last_key = None
+    removed = 0
+
+    while True:
+        query = (
+            select(UserSubscription.id, UserSubscription.user_id, UserSubscription.subscription_end)
+            .where(UserSubscription.subscription_end < current_time)
+            .order_by(UserSubscription.subscription_end, UserSubscription.id)
+            .limit(chunk_size)
+        )
+        if last_key is not None:
+            query = query.where(tuple_(UserSubscription.subscription_end, UserSubscription.id) > last_key)
+        async with async_session() as session:
+            rows = (await session.execute(query)).all()
+        if not rows:
+            break
+        last_key = (rows[-1].subscription_end, rows[-1].id)
+
+        removed += await _expire_chunk([row.user_id for row in rows], current_time, concurrency)
+
+    if removed:
+        print(f"Removed {removed} expired users")
+    return removed
+
+
+async def _expire_chunk(user_ids: list, current_time: datetime, concurrency: int):
+    kicked = await _kick_users(user_ids, concurrency)
+    await _delete_kicked(kicked, current_time)
+    return len(kicked)
+
+
+async def _delete_kicked(kicked: list, current_time: datetime):
+    if kicked:
+        async with async_session() as session:
+            async with session.begin():
+                # Повторная проверка срока: подписку могли продлить во время чистки
+                await session.execute(
+                    delete(UserSubscription).where(
+                        UserSubscription.user_id.in_(kicked),
+                        UserSubscription.subscription_end < current_time,
+                    )
+                )
+        for user_id in kicked:
+            notify_subscription_changed(user_id, None)
+
+
+async def expire_users(user_ids: list, concurrency: int = 8):
+    # Точечное удаление: только те из user_ids, чья подписка действительно истекла.
+    # Возвращает (удалено, список не удалённых из канала) - их планировщик повторит
+    current_time = datetime.now(timezone.utc)
+    async with async_session() as session:
+        expired = (await session.scalars(
+            select(UserSubscription.user_id).where(
+                UserSubscription.user_id.in_(user_ids),
+                UserSubscription.subscription_end < current_time,
+            )
+        )).all()
+    if not expired:
+        return 0, []
+    kicked = await _kick_users(list(expired), concurrency)
+    await _delete_kicked(kicked, current_time)
+    kicked = set(kicked)
+    return len(kicked), [user_id for user_id in expired if user_id not in kicked]
+
+
+async def get_expiring_subscriptions(after: datetime, until: datetime, chunk_size: int = 1000):
+    # Подписки с after <= subscription_end < until (по индексу), порциями
+    last_key = None
+    while True:
+        query = (
+            select(UserSubscription.id, UserSubscription.user_id, UserSubscription.subscription_end)
+            .where(UserSubscription.subscription_end >= after, UserSubscription.subscription_end < until)
+            .order_by(UserSubscription.subscription_end, UserSubscription.id)
+            .limit(chunk_size)
+        )
+        if last_key is not None:
+            query = query.where(tuple_(UserSubscription.subscription_end, UserSubscription.id) > last_key)
+        async with async_session() as session:
+            rows = (await session.execute(query)).all()
+        if not rows:
+            return
+        last_key = (rows[-1].subscription_end, rows[-1].id)
+        for row in rows:
+            yield row.user_id, row.subscription_end
+
 
 # Функция для расчёта суммы в волатильной криптовалюте
 async def calculate_crypto_amount(fiat_amount: float, crypto_rate: float) -> float:
-    return fiat_amount / crypto_rate
+    # Сумма показывается пользователю с AMOUNT_DECIMALS знаками, поэтому округляем вверх:
+    # ровно показанная сумма покрывает цену. round(..., 6) гасит шум float перед ceil
+    scale = 10 ** AMOUNT_DECIMALS
+    return math.ceil(round(fiat_amount / crypto_rate * scale, 6)) / scale
+
+
+def coin_amount(value: float) -> float:
+    # Суммы в монетах сравниваются с точностью до показанных пользователю знаков
+    return round(float(value), AMOUNT_DECIMALS)
 
 # Инициация оплаты
-async def initiate_paymentTON(user_id: BigInteger, fiat_amount: float, crypto_rate: float, transaction_hash: str):
-    # Фиксируем курс и создаём окно времени
-    crypto_amount = await calculate_crypto_amount(fiat_amount, crypto_rate)
+async def initiate_payment(ccy: str, user_id: BigInteger, fiat_amount: float, crypto_rate: float, transaction_hash: str):
+    # Создаём окно времени
     payment_window_end = datetime.now(timezone.utc) + timedelta(minutes=45)
     payment_window_end = payment_window_end.astimezone(timezone.utc)
-    
 
     # Сохраняем информацию о платеже в базе данных
     async with async_session() as session:
         async with session.begin():
+            # Фиксируем курс: если он не передан, берём последний из истории курсов
+            if crypto_rate is None:
+                crypto_rate = await get_latest_rate(ccy, session)
+                if crypto_rate is None:
+                    return None, None
+            crypto_amount = await calculate_crypto_amount(fiat_amount, crypto_rate)
             payment_info = PaymentInfo(
                 user_id=user_id,
                 crypto_amount=crypto_amount,
                 crypto_rate=crypto_rate,
                 payment_window_end=payment_window_end,
-                transaction_hash =transaction_hash,
-                ccy="TON",
+                transaction_hash =transaction_hash or None,
+                ccy=ccy,
                 status="pending"
                   # Статус ожидает оплаты
             )
             session.add(payment_info)
-            await session.commit()
+            await session.flush()
+            pending = _pending_from_row(payment_info)
+    pending_payments.add(pending)
     return crypto_amount, payment_window_end
 
-async def initiate_paymentLTC(user_id: BigInteger, fiat_amount: float, crypto_rate: float, transaction_hash: str):
-    # Фиксируем курс и создаём окно времени
-    crypto_amount = await calculate_crypto_amount(fiat_amount, crypto_rate)
-    payment_window_end = datetime.now(timezone.utc) + timedelta(minutes=45)
-    payment_window_end = payment_window_end.astimezone(timezone.utc)
-    
-
-    # Сохраняем информацию о платеже в базе данных
+def _pending_from_row(row):
+    return PendingPayment(
+        id=row.id,
+        user_id=row.user_id,
+        ccy=row.ccy,
+        crypto_amount=row.crypto_amount,
+        crypto_rate=row.crypto_rate,
+        payment_window_end=row.payment_window_end.astimezone(timezone.utc),
+        transaction_hash=row.transaction_hash or None,
+    )
+
+async def get_pending_payments():
+    # Ожидающие платежи с ещё открытым окном оплаты (по ix_pay_info_status_window_end)
+    async with async_session() as session:
+        result = await session.execute(
+            select(PaymentInfo.id, PaymentInfo.user_id, PaymentInfo.ccy, PaymentInfo.crypto_amount,
+                   PaymentInfo.crypto_rate, PaymentInfo.payment_window_end, PaymentInfo.transaction_hash)
+            .where(PaymentInfo.status == 'pending', PaymentInfo.payment_window_end > datetime.now(timezone.utc))
+            .order_by(PaymentInfo.id)
+        )
+        return [_pending_from_row(row) for row in result]
+
+async def load_pending_payments():
+    for payment in await get_pending_payments():
+        pending_payments.add(payment)
+    return len(pending_payments)
+
+async def expire_pending_payments():
+    # Одним UPDATE помечаем платежи с закрытым окном; индекс в памяти чистится сам.
+    # Заодно удаляем просроченные заявки на хэши
+    pending_payments.purge()
+    now = datetime.now(timezone.utc)
     async with async_session() as session:
         async with session.begin():
-            payment_info = PaymentInfo(
-                user_id=user_id,
-                crypto_amount=crypto_amount,
-                crypto_rate=crypto_rate,
-                payment_window_end=payment_window_end,
-                transaction_hash =transaction_hash,
-                ccy="LTC",
-                status="pending"
-                  # Статус ожидает оплаты
+            result = await session.execute(
+                update(PaymentInfo)
+                .where(PaymentInfo.status == 'pending', PaymentInfo.payment_window_end <= now)
+                .values(status='expired')
             )
-            session.add(payment_info)
-            await session.commit()
-    return crypto_amount, payment_window_end
-
-# Проверка поступления оплаты
-async def check_payment(transaction_hash: str, amount_received: float):
-    async with async_session() as session:
-        current_time = datetime.now(timezone.utc)
-        # Ищем запись транзакции
-        payment_info = await session.scalar(
-            select(PaymentInfo)
-            .where(PaymentInfo.transaction_hash == transaction_hash)
-            .order_by(PaymentInfo.id.desc())  # Сортировка по id, чтобы взять последнюю запись
-)
-        if payment_info:
-            # Приводим время из базы данных к UTC
-            payment_window_end_utc = payment_info.payment_window_end.astimezone(timezone.utc)
-            current_time = datetime.now(timezone.utc)
-            print(f"Current UTC time: {current_time}")
-            print(f"Payment window end time (converted to UTC): {payment_window_end_utc}")
-            if datetime.now(timezone.utc) <= payment_window_end_utc:
-                if amount_received >= payment_info.crypto_amount:
-                    payment_info.status = "completed"  # Обновляем статус на завершён
-                    await session.commit()
-                    await provide_productCrypto(payment_info.user_id, amount_received, payment_info.crypto_rate)
-                else:
-                    await m.bot.send_message(payment_info.user_id, "Insufficient amount. Recheck withdrawal fees/amount.")
-            else:
-                await m.bot.send_message(payment_info.user_id, "The time for payment has expired. Try again/Contact the Admin.")
-        else:
-            await m.bot.send_message(payment_info.user_id, "No transaction found.")
+            await session.execute(delete(DepositClaim).where(DepositClaim.expires_at <= now))
+    return result.rowcount
 
-async def get_transaction_info(user_id: int):
+async def run_payment_expiry(interval: int = 60):
+    while True:
+        try:
+            expired = await expire_pending_payments()
+            if expired:
+                print(f"Marked {expired} payments as expired")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Payment expiry error: {e}")
+        await asyncio.sleep(interval)
+
+async def claim_deposit(tx_hash: str, user_id: int, with_payment: bool, ttl: timedelta = timedelta(minutes=45)):
+    # Заявка на ещё не зачисленный депозит. Чужая живая заявка не перезаписывается:
+    # возвращает False, если хэш уже заявил другой пользователь
+    now = datetime.now(timezone.utc)
+    stmt = pg_insert(DepositClaim).values(tx_hash=tx_hash, user_id=user_id, with_payment=with_payment,
+                                          expires_at=now + ttl)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DepositClaim.tx_hash],
+        set_={'user_id': stmt.excluded.user_id, 'with_payment': stmt.excluded.with_payment,
+              'expires_at': stmt.excluded.expires_at},
+        where=(DepositClaim.user_id == user_id) | (DepositClaim.expires_at <= now),
+    ).returning(DepositClaim.tx_hash)
     async with async_session() as session:
         async with session.begin():
-            deposit_info = await session.scalar(
-                select(Deposit).where(Deposit.user_id == user_id)
-                .order_by(Deposit.id.desc())
-            )
+            claimed = await session.scalar(stmt)
+    return claimed is not None
 
-            if deposit_info:
-                return {
-                    'transaction_hash': deposit_info.txId,  # Поле с хэшем транзакции
-                    'amount_received': deposit_info.amount  # Поле с полученной суммой
-                }
-            else:
-                return None
 
-async def update_payment_info_with_hash(user_id: int, transaction_hash: str):
+async def get_deposit_claims(tx_hashes):
+    # Живые заявки по пачке хэшей: tx_hash -> (user_id, with_payment)
+    if not tx_hashes:
+        return {}
     async with async_session() as session:
-        payment_info = await session.scalar(
-            select(PaymentInfo).where(PaymentInfo.user_id == user_id)
-            .order_by(PaymentInfo.id.desc())
+        rows = await session.execute(
+            select(DepositClaim.tx_hash, DepositClaim.user_id, DepositClaim.with_payment)
+            .where(DepositClaim.tx_hash.in_(tx_hashes), DepositClaim.expires_at > datetime.now(timezone.utc))
         )
-        if payment_info:
-            payment_info.transaction_hash = transaction_hash
-            await session.commit()
+        return {row.tx_hash: (row.user_id, row.with_payment) for row in rows}
 
 
-async def add_user(user_id):
+async def release_deposit_claim(tx_hash: str):
     async with async_session() as session:
         async with session.begin():
-            # Проверяем, существует ли уже запись с данным user_id
-            existing_user = await session.execute(
-                select(UserTrack).where(UserTrack.user_id == user_id)
-            )
-            existing_user = existing_user.scalar_one_or_none()
+            await session.execute(delete(DepositClaim).where(DepositClaim.tx_hash == tx_hash))
 
-            if existing_user is None:
-                # Если пользователя нет, добавляем нового
-                new_user = UserTrack(user_id=user_id)
-                session.add(new_user)
-            else:
-                print("User is already exists.")
-        await session.commit()
 
+async def find_payment_by_amount(ccy: str, amount: float):
+    # Пользователь, чей ожидающий платёж ждёт ровно эту сумму (8 знаков, как в сообщении).
+    # Несколько одинаковых сумм - кто заплатил, понятно только по хэшу, возвращаем None
+    async with async_session() as session:
+        user_ids = (await session.scalars(
+            select(PaymentInfo.user_id).distinct()
+            .where(
+                PaymentInfo.status == 'pending',
+                PaymentInfo.payment_window_end > datetime.now(timezone.utc),
+                PaymentInfo.ccy == ccy,
+                func.round(cast(PaymentInfo.crypto_amount, Numeric), AMOUNT_DECIMALS) == coin_amount(amount),
+            )
+            .limit(2)
+        )).all()
+    return user_ids[0] if len(user_ids) == 1 else None
 
-async def find_matching_deposit(transaction_hash: str):
+
+async def add_users(user_ids):
+    # Пачка пользователей одним INSERT; уже существующие пропускаются
+    if not user_ids:
+        return
+    stmt = pg_insert(UserTrack).values([{'user_id': user_id} for user_id in user_ids])
+    stmt = stmt.on_conflict_do_nothing(index_elements=[UserTrack.user_id])
     async with async_session() as session:
         async with session.begin():
-            deposits = await session.execute(
-                select(Deposit).where(
-                    Deposit.txId == transaction_hash,
-                )
-            )
-            deposit = deposits.scalar_one_or_none()
-
-            if deposit:
-                if deposit.state == 2:  # Пример проверки состояния (2 - завершено)
-                    print('Transaction completed')
-                    return {
-                        'status': 'completed',  # Возвращаем статус completed
-                        'amount': deposit.amount,  # Возвращаем сумму транзакции
-                        'ccy': deposit.ccy
-                    }
-                else:
-                    print('Transaction pending')
-                    return {
-                        'status': 'pending',  # Возвращаем статус pending
-                        'amount': deposit.amount, # Также возвращаем сумму, даже если pending
-                        'ccy': deposit.ccy
-                    }
-            print("Transaction not found")
-            return None
+            await session.execute(stmt)
+
 
+# Функция для обработки депозита
+async def store_deposits(deposits):
+    # Пачка депозитов одним INSERT ... ON CONFLICT (txId) DO UPDATE.
+    # Повторы одного txId в пачке схлопываются, остаётся запись с наибольшим state
+    latest = {}
+    for deposit in deposits:
+        current = latest.get(deposit['transaction_hash'])
+        if current is None or deposit['state'] >= current['state']:
+            latest[deposit['transaction_hash']] = deposit
+    if not latest:
+        return
 
-async def get_expected_currency(transaction_hash: str):
+    rows = [
+        {
+            'txId': deposit['transaction_hash'],
+            'amount': deposit['amount'],
+            'state': deposit['state'],
+            'timestamp': deposit['timestamp'],
+            'ccy': deposit['currency'],
+        }
+        for deposit in latest.values()
+    ]
+    stmt = pg_insert(Deposit).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Deposit.txId],
+        set_={
+            'amount': stmt.excluded.amount,
+            'state': stmt.excluded.state,
+            'timestamp': stmt.excluded.timestamp,
+        },
+    )
     async with async_session() as session:
         async with session.begin():
-            # Получаем ожидаемую валюту для пользователя из базы данных
-            result = await session.execute(
-                select(PaymentInfo.ccy).where(PaymentInfo.transaction_hash == transaction_hash)
-            )
-            expected_ccy = result.scalar_one_or_none()
+            await session.execute(stmt)
+
+# Стоимость подписок в $ (месяцы -> цена)
+SUBSCRIPTION_PRICES = {plan.months: plan.price for plan in PLANS.values()}
+
+# Результаты verify_and_settle
+SETTLE_COMPLETED = 'completed'
+SETTLE_PENDING = 'pending'
+SETTLE_NOT_FOUND = 'not_found'
+SETTLE_ALREADY_USED = 'already_used'
+SETTLE_NO_PAYMENT = 'no_payment'
+SETTLE_CURRENCY_MISMATCH = 'currency_mismatch'
+SETTLE_EXPIRED = 'expired'
+SETTLE_INSUFFICIENT = 'insufficient'
+
+
+@dataclass
+class SettlementResult:
+    status: str
+    tx_hash: str
+    user_id: int
+    amount: float = None
+    ccy: str = None
+    expected_ccy: str = None
+    months: int = 0
+    subscription_end: datetime = None
+    owner_id: int = None  # кому уже засчитан депозит (SETTLE_ALREADY_USED)
+
+
+def _months_for_amount(amount: float, crypto_rate: float = 1.0) -> int:
+    # Максимальный план, который покрывает сумма (цены в $, сумма в монетах)
+    months = 0
+    for months_option, price in SUBSCRIPTION_PRICES.items():
+        if coin_amount(amount) >= coin_amount(price / crypto_rate):
+            months = months_option
+    return months
 
-            if expected_ccy is None:
-                print("Expected currency not found for this user")
-                return None
 
-            return expected_ccy
+def _grant_statement(user_id: int, months: int):
+    # Один атомарный upsert: продление от max(сейчас, текущий конец), без чтения в Python.
+    # xmax = 0 у только что вставленной строки - так отличаем новую подписку от продления
+    period = literal(timedelta(days=30 * months), Interval())
+    stmt = pg_insert(UserSubscription).values(
+        user_id=user_id,
+        subscription_start=func.now(),
+        subscription_end=func.now() + period,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[UserSubscription.user_id],
+        set_={'subscription_end': func.greatest(func.now(), UserSubscription.subscription_end) + period},
+    ).returning(UserSubscription.subscription_end, literal_column('xmax = 0').label('created'))
 
 
-async def get_user_id_by_transaction_hash(transaction_hash: str):
+async def _extend_subscription(session: AsyncSession, user_id: int, months: int):
+    # Внутри чужой транзакции; notify_subscription_changed - на вызывающей стороне после коммита
+    row = (await session.execute(_grant_statement(user_id, months))).one()
+    return row.subscription_end
+
+
+async def grant_subscription(user_id: int, months: int):
+    # Выдача/продление подписки на months месяцев. Возвращает (новый конец, создана ли подписка)
     async with async_session() as session:
         async with session.begin():
-            # Ищем запись депозита с данным transaction_hash
-            deposit = await session.scalar(
-                select(Deposit.user_id).where(Deposit.txId == transaction_hash)
-            )
-            return deposit
-
-# Функция для обработки депозита
-async def handle_deposit(transaction_hash: str, amount: float, state: int, timestamp: datetime, currency: str):
+            row = (await session.execute(_grant_statement(user_id, months))).one()
+    notify_subscription_changed(user_id, row.subscription_end)
+    return row.subscription_end, row.created
+
+
+async def grant_subscriptions(grants):
+    # Пакетная выдача: grants - список (user_id, months), один upsert на пачку.
+    # Период каждой строки передаётся как subscription_end - subscription_start вставляемой строки
+    if not grants:
+        return []
+    now = datetime.now(timezone.utc)
+    stmt = pg_insert(UserSubscription).values([
+        {'user_id': user_id, 'subscription_start': now, 'subscription_end': now + timedelta(days=30 * months)}
+        for user_id, months in grants
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserSubscription.user_id],
+        set_={'subscription_end': func.greatest(func.now(), UserSubscription.subscription_end)
+              + (stmt.excluded.subscription_end - stmt.excluded.subscription_start)},
+    ).returning(UserSubscription.user_id, UserSubscription.subscription_end)
     async with async_session() as session:
         async with session.begin():
-            # Попытка найти существующую запись с таким же txId
-            deposit = await session.scalar(
-                select(Deposit).where(Deposit.txId == transaction_hash)
-            )
-            
-            if deposit:
-                # Если запись уже существует, обновляем поля
-                deposit.amount = amount
-                deposit.state = state
-                deposit.timestamp = timestamp
-            else:
-                # Если записи не существует, создаём новую
-                deposit = Deposit(
-                    txId=transaction_hash,
-                    amount=amount,
-                    state=state,
-                    timestamp=timestamp,
-                    ccy=currency
-                )
-                session.add(deposit)
+            rows = (await session.execute(stmt)).all()
+    for row in rows:
+        notify_subscription_changed(row.user_id, row.subscription_end)
+    return rows
+
+
+async def stream_subscriptions(chunk_size: int = 1000):
+    # Вся таблица users через серверный курсор, без загрузки в память
+    query = (
+        select(UserSubscription.user_id, UserSubscription.subscription_start, UserSubscription.subscription_end)
+        .order_by(UserSubscription.user_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    async with async_session() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            for row in partition:
+                yield row
 
-        # Коммитим изменения
-        await session.commit()
 
-async def link_deposit_with_user(transaction_hash: str, user_id: int):
+async def verify_and_settle(tx_hash: str, user_id: int, with_payment: bool = True) -> SettlementResult:
+    # Проверка хэша и выдача подписки в одной транзакции.
+    # Депозит и ожидающий платёж блокируются (SELECT ... FOR UPDATE), поэтому
+    # один и тот же хэш, отправленный одновременно двумя пользователями, засчитается один раз.
+    # with_payment=False - оплата без PaymentInfo (USDT), сумма депозита уже в $.
     async with async_session() as session:
         async with session.begin():
             deposit = await session.scalar(
-                select(Deposit).where(Deposit.txId == str(transaction_hash))
+                select(Deposit).where(Deposit.txId == tx_hash).with_for_update()
             )
-            
-            if deposit:
-                # Проверяем, связан ли уже этот transaction_hash с каким-либо user_id
-                if deposit.user_id is not None:
-                    print(f"Transaction hash {transaction_hash} уже связан с user_id {deposit.user_id}")
-                    return False  # Возвращаем False, если transaction_hash уже связан с пользователем
-                # Обновляем запись в таблице deposits, добавляя user_id
-                deposit.user_id = user_id
-                session.add(deposit)
-                await session.commit()
-                print(f"Deposit {transaction_hash} linked with user {user_id}")
-                return True  # Транзакция успешно привязана
+            if deposit is None:
+                return SettlementResult(SETTLE_NOT_FOUND, tx_hash, user_id)
+
+            result = SettlementResult(SETTLE_PENDING, tx_hash, user_id, amount=deposit.amount, ccy=deposit.ccy)
+            if deposit.state != 2:  # 2 - завершено
+                return result
+            if deposit.user_id is not None:
+                result.status = SETTLE_ALREADY_USED
+                result.owner_id = deposit.user_id
+                return result
+
+            if with_payment:
+                pending = pending_payments.by_user(user_id)
+                if pending is not None:
+                    payment_info = await session.scalar(
+                        select(PaymentInfo)
+                        .where(PaymentInfo.id == pending.id, PaymentInfo.status == 'pending')
+                        .with_for_update()
+                    )
+                else:
+                    # Платёж мог быть создан другим воркером или уже помечен истёкшим
+                    payment_info = await session.scalar(
+                        select(PaymentInfo)
+                        .where(PaymentInfo.user_id == user_id, PaymentInfo.status.in_(('pending', 'expired')))
+                        .order_by(PaymentInfo.id.desc())
+                        .limit(1)
+                        .with_for_update()
+                    )
+                if payment_info is None:
+                    result.status = SETTLE_NO_PAYMENT
+                    return result
+                result.expected_ccy = payment_info.ccy
+                if payment_info.ccy != deposit.ccy:
+                    result.status = SETTLE_CURRENCY_MISMATCH
+                    return result
+                if datetime.now(timezone.utc) > payment_info.payment_window_end.astimezone(timezone.utc):
+                    result.status = SETTLE_EXPIRED
+                    return result
+                if coin_amount(deposit.amount) < coin_amount(payment_info.crypto_amount):
+                    result.status = SETTLE_INSUFFICIENT
+                    return result
+                result.months = _months_for_amount(deposit.amount, payment_info.crypto_rate)
+                payment_info.status = 'completed'
+                payment_info.transaction_hash = tx_hash
             else:
-                print("Deposit not found")
-                return False
+                result.months = _months_for_amount(deposit.amount)
+
+            if result.months == 0:
+                result.status = SETTLE_INSUFFICIENT
+                return result
+
+            deposit.user_id = user_id
+            result.subscription_end = await _extend_subscription(session, user_id, result.months)
+            result.status = SETTLE_COMPLETED
+    if with_payment:
+        pending_payments.remove(user_id)
+    notify_subscription_changed(user_id, result.subscription_end)
+    return result
+
+
+async def deliver_access(user_id: int, months: int):
+    # Выдача доступа после оплаты идёт вне очереди рассылок и чистки
+    with telegram_gateway.lane(telegram_gateway.PAYMENT):
+        invite_link = await issue_invite_link(user_id)
+        await bot.send_message(user_id, f"Congratulations! Your subscription activated for {months} month(s). There is your link to the channel: {invite_link}. \n <i>Enjoy!</i>😈🔥", parse_mode="HTML")
+
 
 async def cancel_payment(user_id: int):
     async with async_session() as session:
         async with session.begin():
-            # Находим запись платежа по user_id
-            payment_info = await session.scalar(
-                select(PaymentInfo).where(PaymentInfo.user_id == user_id)
-                .order_by(PaymentInfo.id.desc())
-            )
+            # Находим запись платежа по user_id: индекс в памяти, при промахе - последний в БД
+            pending = pending_payments.remove(user_id)
+            if pending is not None:
+                payment_info = await session.get(PaymentInfo, pending.id)
+            else:
+                payment_info = await session.scalar(
+                    select(PaymentInfo).where(PaymentInfo.user_id == user_id)
+                    .order_by(PaymentInfo.id.desc())
+                    .limit(1)
+                )
             if payment_info:
                 await session.delete(payment_info)  # Удаляем запись
                 await session.commit()
             else:
-                await m.bot.send_message(user_id, "No active payment found.")
-
+                await bot.send_message(user_id, "No active payment found.")
 
-async def provide_product(user_id: int, amount: float):
-    subscription_prices = {
-        1: 6,   # 1 месяц стоит 6$
-        3: 15   # 3 месяца стоят 15$
-    }
-
-    # Определяем количество месяцев на основе суммы депозита
-    months = 0
-    for months_option, price in subscription_prices.items():
-        if amount >= price:
-            months = months_option
-
-    if months == 0:
-        await m.bot.send_message(user_id, "Insufficient amount to subscribe.")
-        return
-    # Логика предоставления продукта. Например, активация подписки.
-    async with async_session() as session:
-        user = await session.scalar(select(UserSubscription).where(UserSubscription.user_id == user_id))
-        if not user:
-            # Если пользователь ещё не имеет подписки, создаём новую запись
-            new_subscription = UserSubscription(
-                user_id=user_id,
-                subscription_start=datetime.now(timezone.utc),
-                subscription_end=datetime.now(timezone.utc) + timedelta(days=30 * months)  # Увеличиваем на количество месяцев
-            )
-            session.add(new_subscription)
-        else:
-            # Продлеваем подписку
-            user.subscription_end += timedelta(days=30 * months)  # Увеличиваем на количество месяцев
-        
-        await session.commit()
-    result = await m.bot.create_chat_invite_link(CHANNEL_ID, member_limit=1)
-    await m.bot.send_message(user_id, f"Congratulations! Your subscription activated for {months} month(s). There is your link to the channel: {result.invite_link}. Enjoy😈🔥")
-
-async def provide_productCrypto(user_id: int, amount: float, crypto_rate: float):
-    # Определяем стоимость подписок в фиатной валюте
-    subscription_prices = {
-        1: 6,  # 1 месяц
-        3: 15  # 3 месяца
-    }
-    
-    # Определяем сколько криптовалюты нужно для каждой подписки
-    subscription_costs_in_crypto = {months: price / crypto_rate for months, price in subscription_prices.items()}
-
-    months = 0
-    for months_option, crypto_price in subscription_costs_in_crypto.items():
-        if amount >= crypto_price:
-            months = months_option
-
-    if months == 0:
-        await m.bot.send_message(user_id, "Insufficient amount to subscribe.")
-        return
-    
-    async with async_session() as session:
-        user = await session.scalar(select(UserSubscription).where(UserSubscription.user_id == user_id))
-        if not user:
-            # Если пользователь ещё не имеет подписки, создаём новую запись
-            new_subscription = UserSubscription(
-                user_id=user_id,
-                subscription_start=datetime.now(timezone.utc),
-                subscription_end=datetime.now(timezone.utc) + timedelta(days=30 * months)  # Увеличиваем на количество месяцев
-            )
-            session.add(new_subscription)
-        else:
-            # Продлеваем подписку
-            user.subscription_end += timedelta(days=30 * months)  # Увеличиваем на количество месяцев
-        
-        await session.commit()
-    result = await m.bot.create_chat_invite_link(CHANNEL_ID, member_limit=1)
-    await m.bot.send_message(user_id, f"Congratulations! Your subscription activated for {months} month(s). There is your link to the channel: {result.invite_link}. \n <i>Enjoy!</i>😈🔥")
 
 async def some_async_function():
     # Асинхронный код
@@ -437,11 +816,21 @@ async def add_subscription(user_id: BigInteger, start_date: datetime, end_date:
                 subscription_end=end_date
             )
             session.add(new_subscription)
-            await session.commit()
+    notify_subscription_changed(user_id, end_date)
            
 
 # Функция для получения подписки пользователя
 async def get_subscription(user_id: BigInteger):
+    cached = subscription_cache.get(user_id)
+    if cached is not MISSING:
+        return cached
+    subscription = await _load_subscription(user_id)
+    if subscription is not MISSING:
+        subscription_cache.set(user_id, subscription)
+        return subscription
+    return None
+
+async def _load_subscription(user_id: BigInteger):
     async with async_session() as session:
         async with session.begin():
             try:
@@ -450,33 +839,141 @@ async def get_subscription(user_id: BigInteger):
                 subscription = result.first()
                 
                 if subscription:
-                    return subscription
+                    return tuple(subscription)
                 else:
                     print("No subscription found.")
                     return None
             except Exception as e:
+                # Ошибку БД не кэшируем
                 print(f"Error during DB query execution: {e}")
-                return None
+                return MISSING
                        
 async def provide_productStars(user_id: int, months: int):
     # Логика предоставления продукта и активации подписки
+    await grant_subscription(user_id, months)
+
+    invite_link = await issue_invite_link(user_id)
+    return f"Your subscription is active for {months} month(s). Here is your link: {invite_link}"
+
+
+async def create_broadcast(audience: str, text: str = None, from_chat_id: int = None, message_id: int = None,
+                           runner_id: str = None, notify_chat_id: int = None):
+    now = datetime.now(timezone.utc)
     async with async_session() as session:
-        user = await session.scalar(select(UserSubscription).where(UserSubscription.user_id == user_id))
-        if not user:
-            # Если пользователя нет в базе, создаём новую запись
-            new_subscription = UserSubscription(
-                user_id=user_id,
-                subscription_start=datetime.now(timezone.utc),
-                subscription_end=datetime.now(timezone.utc) + timedelta(days=30 * months)
+        async with session.begin():
+            broadcast = Broadcast(
+                audience=audience,
+                text=text,
+                from_chat_id=from_chat_id,
+                message_id=message_id,
+                status='running',
+                delivered=0,
+                blocked=0,
+                failed=0,
+                created_at=now,
+                runner_id=runner_id,
+                heartbeat_at=now,
+                notify_chat_id=notify_chat_id,
             )
-            session.add(new_subscription)
-        else:
-            # Продлеваем подписку
-            user.subscription_end += timedelta(days=30 * months)
+            session.add(broadcast)
+    return broadcast
+
+
+async def get_broadcast(broadcast_id: int):
+    async with async_session() as session:
+        return await session.get(Broadcast, broadcast_id)
+
+
+async def get_running_broadcasts():
+    async with async_session() as session:
+        return (await session.scalars(
+            select(Broadcast).where(Broadcast.status == 'running').order_by(Broadcast.id)
+        )).all()
 
-        await session.commit()
 
-    result = await m.bot.create_chat_invite_link(CHANNEL_ID, member_limit=1)
-    return f"Your subscription is active for {months} month(s). Here is your link: {result.invite_link}"
+async def claim_broadcast(broadcast_id: int, runner_id: str, lease: timedelta):
+    # Атомарно берём рассылку себе: она свободна, уже наша или её воркер перестал
+    # обновлять heartbeat_at. Возвращает актуальную строку или None
+    now = datetime.now(timezone.utc)
+    async with async_session() as session:
+        async with session.begin():
+            return await session.scalar(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == 'running',
+                    (Broadcast.runner_id.is_(None)) | (Broadcast.runner_id == runner_id)
+                    | (Broadcast.heartbeat_at < now - lease),
+                )
+                .values(runner_id=runner_id, heartbeat_at=now)
+                .returning(Broadcast)
+            )
 
 
+async def heartbeat_broadcast(broadcast_id: int, runner_id: str):
+    # False - рассылка отменена или перехвачена другим воркером
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == 'running', Broadcast.runner_id == runner_id)
+                .values(heartbeat_at=datetime.now(timezone.utc))
+            )
+    return result.rowcount > 0
+
+
+async def release_broadcasts(runner_id: str):
+    # При остановке воркера его рассылки сразу доступны другим
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.runner_id == runner_id, Broadcast.status == 'running')
+                .values(runner_id=None)
+            )
+
+
+async def checkpoint_broadcast(broadcast_id: int, runner_id: str, last_user_id: int, delivered: int, blocked: int,
+                               failed: int):
+    # Счётчики прибавляются, last_user_id - последний обработанный в порядке user_id.
+    # Возвращает False, если рассылка уже не running (отменена из любого воркера)
+    # или её ведёт другой воркер
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == 'running', Broadcast.runner_id == runner_id)
+                .values(
+                    heartbeat_at=datetime.now(timezone.utc),
+                    last_user_id=last_user_id,
+                    delivered=Broadcast.delivered + delivered,
+                    blocked=Broadcast.blocked + blocked,
+                    failed=Broadcast.failed + failed,
+                )
+            )
+    return result.rowcount > 0
+
+
+async def finish_broadcast(broadcast_id: int, status: str):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == 'running')
+                .values(status=status, finished_at=datetime.now(timezone.utc))
+            )
+
+
+async def fetch_broadcast_recipients(audience: str, after_user_id: int = None, limit: int = 500):
+    # Следующая порция получателей по возрастанию user_id (keyset по уникальному индексу).
+    # Короткий запрос на порцию: соединение не держится открытым всю рассылку
+    if audience == 'active':
+        query = select(UserSubscription.user_id).where(UserSubscription.subscription_end > datetime.now(timezone.utc))
+        column = UserSubscription.user_id
+    else:
+        query = select(UserTrack.user_id)
+        column = UserTrack.user_id
+    if after_user_id is not None:
+        query = query.where(column > after_user_id)
+    async with async_session() as session:
+        return list((await session.scalars(query.order_by(column).limit(limit))).all())
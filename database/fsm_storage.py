@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from database.database import FSMRecord
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLAlchemyStorage(BaseStorage):
+    # FSM-хранилище поверх async SQLAlchemy.
+    # Записи живут ttl (окно оплаты 45 минут) с момента последнего изменения.
+    # Write-through кэш в памяти (cache_ttl > 0) отдаёт состояние без запроса к БД;
+    # он допустим только когда все апдейты чата обрабатывает один процесс.
+    # С cache_ttl=0 каждое чтение идёт в БД по первичному ключу, и несколько
+    # воркеров видят одно и то же состояние.
+
+    def __init__(self, session_factory, ttl=timedelta(minutes=45), cache_ttl=30, purge_interval=600):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.purge_interval = purge_interval
+        self._cache = {}  # key -> (state, data, expires_at, cached_at)
+        self._purge_task = None
+
+    @staticmethod
+    def _build_key(key):
+        parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id or '', key.destiny]
+        business_connection_id = getattr(key, 'business_connection_id', None)
+        if business_connection_id:
+            parts.append(business_connection_id)
+        return ':'.join(str(part) for part in parts)
+
+    async def _load(self, key):
+        now = datetime.now(timezone.utc)
+        cached = self._cache.get(key) if self.cache_ttl > 0 else None
+        if cached is not None:
+            state, data, expires_at, cached_at = cached
+            if expires_at <= now:
+                self._cache.pop(key, None)
+                return None, {}
+            if time.monotonic() - cached_at < self.cache_ttl:
+                return state, data
+
+        async with self.session_factory() as session:
+            record = await session.scalar(select(FSMRecord).where(FSMRecord.key == key))
+        if record is None or record.expires_at <= now:
+            self._cache.pop(key, None)
+            return None, {}
+        data = dict(record.data or {})
+        if self.cache_ttl > 0:
+            self._cache[key] = (record.state, data, record.expires_at, time.monotonic())
+        return record.state, data
+
+    async def _store(self, key, **values):
+        self._ensure_purger()
+        state, data = await self._load(key)
+        state = values.get('state', state)
+        data = values.get('data', data)
+        expires_at = datetime.now(timezone.utc) + self.ttl
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                if state is None and not data:
+                    # Пустую запись не храним
+                    await session.execute(delete(FSMRecord).where(FSMRecord.key == key))
+                else:
+                    stmt = insert(FSMRecord).values(key=key, state=state, data=data, expires_at=expires_at)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[FSMRecord.key],
+                        set_={'state': state, 'data': data, 'expires_at': expires_at},
+                    )
+                    await session.execute(stmt)
+
+        if state is None and not data or self.cache_ttl <= 0:
+            self._cache.pop(key, None)
+        else:
+            self._cache[key] = (state, data, expires_at, time.monotonic())
+
+    async def set_state(self, key, state=None):
+        if isinstance(state, State):
+            state = state.state
+        await self._store(self._build_key(key), state=state)
+
+    async def get_state(self, key):
+        state, _ = await self._load(self._build_key(key))
+        return state
+
+    async def set_data(self, key, data):
+        await self._store(self._build_key(key), data=dict(data))
+
+    async def get_data(self, key):
+        _, data = await self._load(self._build_key(key))
+        return dict(data)
+
+    def _ensure_purger(self):
+        if self._purge_task is None:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def purge_expired(self):
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as session:
+            async with session.begin():
+                await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= now))
+        for key in [key for key, cached in self._cache.items() if cached[2] <= now]:
+            self._cache.pop(key, None)
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                logger.warning("FSM storage purge failed: %s", e)
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+        self._cache.clear()
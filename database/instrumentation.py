@@ -0,0 +1,138 @@
+import bisect
+import re
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+
+# Верхние границы корзин гистограммы, мс
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_TARGET = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def statement_key(statement):
+    # "SELECT users", "INSERT deposits": одна строка статистики на вид запроса,
+    # независимо от параметров и длины VALUES в пачках
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '?'
+    target = _TARGET.search(statement)
+    return f"{verb} {target.group(1)}" if target else verb
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def quantile(self, q):
+        # Оценка по верхней границе корзины
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_ms': round(self.sum, 3),
+            'max_ms': round(self.max, 3),
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'buckets': dict(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+
+class DBStats:
+    # Статистика движка через события SQLAlchemy: латентность по видам запросов,
+    # ожидание соединения из пула и последние медленные запросы.
+
+    def __init__(self, slow_query_ms=200, slow_samples=50):
+        self.slow_query_ms = slow_query_ms
+        self.statements = {}  # statement_key -> LatencyHistogram
+        self.checkout_wait = LatencyHistogram()
+        self.slow = deque(maxlen=slow_samples)
+        self.errors = 0
+        self._pool = None
+
+    def install(self, engine):
+        sync_engine = getattr(engine, 'sync_engine', engine)
+        event.listen(sync_engine, 'before_cursor_execute', self._before_execute)
+        event.listen(sync_engine, 'after_cursor_execute', self._after_execute)
+        event.listen(sync_engine, 'handle_error', self._on_error)
+        self._wrap_pool(sync_engine.pool)
+
+    def _wrap_pool(self, pool):
+        # У пула нет события "до выдачи соединения", поэтому время ожидания
+        # меряем обёрткой вокруг pool.connect() этого экземпляра пула
+        self._pool = pool
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                self.checkout_wait.observe((time.perf_counter() - started) * 1000)
+
+        pool.connect = timed_connect
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        elapsed = (time.perf_counter() - started) * 1000
+        key = statement_key(statement)
+        histogram = self.statements.get(key)
+        if histogram is None:
+            histogram = self.statements[key] = LatencyHistogram()
+        histogram.observe(elapsed)
+        if elapsed >= self.slow_query_ms:
+            self.slow.append({
+                'at': time.time(),
+                'ms': round(elapsed, 3),
+                'statement': ' '.join(statement.split())[:500],
+            })
+
+    def _on_error(self, context):
+        self.errors += 1
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+
+    def pool_status(self):
+        pool = self._pool
+        if pool is None or not hasattr(pool, 'checkedout'):
+            return {}
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+        }
+
+    def snapshot(self):
+        return {
+            'statements': {key: histogram.snapshot() for key, histogram in self.statements.items()},
+            'pool': self.pool_status(),
+            'checkout_wait': self.checkout_wait.snapshot(),
+            'slow_queries': list(self.slow),
+            'errors': self.errors,
+        }
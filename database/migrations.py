@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import sys
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: несколько воркеров, стартующих одновременно, мигрируют по очереди
+MIGRATION_LOCK_ID = 727101
+
+
+@dataclass
+class PlanCheck:
+    # Горячий запрос и индекс, которым он обязан пользоваться
+    query: str
+    index: str
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    statements: list = field(default_factory=list)
+    run_sync: object = None  # функция(sync_conn), выполняется до statements
+    checks: list = field(default_factory=list)
+
+
+# DDL каждой миграции заморожен: схема версии N не зависит от текущих моделей.
+# Baseline - таблицы в том виде, в каком их создавал create_all до появления миграций;
+# индексы и ограничения, добавленные позже, идут следующими версиями
+BASELINE = [
+    "CREATE TABLE IF NOT EXISTS users ("
+    "id SERIAL PRIMARY KEY, "
+    "user_id BIGINT NOT NULL UNIQUE, "
+    "subscription_start TIMESTAMPTZ NOT NULL, "
+    "subscription_end TIMESTAMPTZ NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS pay_info ("
+    "id SERIAL PRIMARY KEY, "
+    "user_id BIGINT NOT NULL, "
+    "crypto_amount FLOAT NOT NULL, "
+    "crypto_rate FLOAT NOT NULL, "
+    "payment_window_end TIMESTAMPTZ NOT NULL, "
+    "status VARCHAR(20) NOT NULL, "
+    "transaction_hash VARCHAR(255) UNIQUE, "
+    "ccy VARCHAR)",
+    "CREATE TABLE IF NOT EXISTS user_track ("
+    "id SERIAL PRIMARY KEY, "
+    "user_id BIGINT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS deposits ("
+    "id SERIAL PRIMARY KEY, "
+    "\"txId\" VARCHAR(255), "
+    "amount FLOAT, "
+    "state INTEGER, "
+    "timestamp TIMESTAMP WITHOUT TIME ZONE, "
+    "user_id BIGINT REFERENCES user_track (user_id), "
+    "ccy VARCHAR)",
+    "CREATE INDEX IF NOT EXISTS ix_deposits_id ON deposits (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS \"ix_deposits_txId\" ON deposits (\"txId\")",
+    "CREATE TABLE IF NOT EXISTS rate_history ("
+    "id BIGSERIAL PRIMARY KEY, "
+    "symbol VARCHAR(10) NOT NULL, "
+    "rate FLOAT NOT NULL, "
+    "fetched_at TIMESTAMPTZ NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS fsm_storage ("
+    "key VARCHAR(255) PRIMARY KEY, "
+    "state VARCHAR(255), "
+    "data JSON, "
+    "expires_at TIMESTAMPTZ NOT NULL)",
+]
+
+
+MIGRATIONS = [
+    Migration(1, "baseline", statements=BASELINE),
+    Migration(
+        2, "hot_path_indexes",
+        statements=[
+            "CREATE INDEX IF NOT EXISTS ix_pay_info_user_id_id ON pay_info (user_id, id DESC)",
+            "CREATE INDEX IF NOT EXISTS ix_pay_info_status_window_end ON pay_info (status, payment_window_end)",
+            "CREATE INDEX IF NOT EXISTS ix_users_subscription_end ON users (subscription_end)",
+            "CREATE INDEX IF NOT EXISTS ix_deposits_user_id_id ON deposits (user_id, id DESC)",
+            "CREATE INDEX IF NOT EXISTS ix_rate_history_symbol_fetched_at ON rate_history (symbol, fetched_at DESC)",
+            "CREATE INDEX IF NOT EXISTS ix_fsm_storage_expires_at ON fsm_storage (expires_at)",
+        ],
+        checks=[
+            PlanCheck("SELECT * FROM pay_info WHERE user_id = 1 ORDER BY id DESC LIMIT 1", "ix_pay_info_user_id_id"),
+            PlanCheck("SELECT id FROM pay_info WHERE status = 'pending' AND payment_window_end <= now()",
+                      "ix_pay_info_status_window_end"),
+            PlanCheck("SELECT user_id FROM users WHERE subscription_end < now()", "ix_users_subscription_end"),
+            PlanCheck("SELECT * FROM deposits WHERE user_id = 1 ORDER BY id DESC LIMIT 1", "ix_deposits_user_id_id"),
+            PlanCheck("SELECT rate FROM rate_history WHERE symbol = 'TON' ORDER BY fetched_at DESC LIMIT 1",
+                      "ix_rate_history_symbol_fetched_at"),
+        ],
+    ),
+    Migration(
+        3, "pay_info_hash_null",
+        statements=[
+            # "" от initiate_paymentTON ломал unique: второй платёж без хэша не вставлялся
+            "UPDATE pay_info SET transaction_hash = NULL WHERE transaction_hash = ''",
+            "ALTER TABLE pay_info ADD CONSTRAINT ck_pay_info_transaction_hash_not_empty "
+            "CHECK (transaction_hash <> '')",
+        ],
+        checks=[
+            PlanCheck("SELECT * FROM pay_info WHERE transaction_hash = 'x'", "pay_info_transaction_hash_key"),
+            PlanCheck("SELECT * FROM deposits WHERE \"txId\" = 'x'", "ix_deposits_txId"),
+        ],
+    ),
+    Migration(
+        4, "invite_links",
+        statements=[
+            "CREATE TABLE IF NOT EXISTS invite_links ("
+            "invite_link VARCHAR(255) PRIMARY KEY, "
+            "created_at TIMESTAMPTZ NOT NULL, "
+            "expires_at TIMESTAMPTZ NOT NULL, "
+            "user_id BIGINT, "
+            "issued_at TIMESTAMPTZ, "
+            "revoked_at TIMESTAMPTZ)",
+            "CREATE INDEX IF NOT EXISTS ix_invite_links_user_id ON invite_links (user_id)",
+        ],
+        checks=[
+            PlanCheck("SELECT * FROM invite_links WHERE user_id = 1", "ix_invite_links_user_id"),
+        ],
+    ),
+    Migration(
+        5, "broadcasts",
+        statements=[
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            "id SERIAL PRIMARY KEY, "
+            "audience VARCHAR(20) NOT NULL, "
+            "from_chat_id BIGINT, "
+            "message_id BIGINT, "
+            "text VARCHAR, "
+            "status VARCHAR(20) NOT NULL, "
+            "last_user_id BIGINT, "
+            "delivered INTEGER NOT NULL, "
+            "blocked INTEGER NOT NULL, "
+            "failed INTEGER NOT NULL, "
+            "created_at TIMESTAMPTZ NOT NULL, "
+            "finished_at TIMESTAMPTZ)",
+        ],
+        checks=[
+            # Курсор рассылки: keyset по user_id
+            PlanCheck("SELECT user_id FROM user_track WHERE user_id > 1 ORDER BY user_id",
+                      "user_track_user_id_key"),
+            PlanCheck("SELECT user_id FROM users WHERE user_id > 1 ORDER BY user_id", "users_user_id_key"),
+        ],
+    ),
+    Migration(
+        6, "deposit_claims",
+        statements=[
+            "CREATE TABLE IF NOT EXISTS deposit_claims ("
+            "tx_hash VARCHAR(255) PRIMARY KEY, "
+            "user_id BIGINT NOT NULL, "
+            "with_payment BOOLEAN NOT NULL, "
+            "expires_at TIMESTAMPTZ NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS ix_deposit_claims_expires_at ON deposit_claims (expires_at)",
+        ],
+        checks=[
+            PlanCheck("SELECT tx_hash FROM deposit_claims WHERE expires_at <= now()", "ix_deposit_claims_expires_at"),
+        ],
+    ),
+    Migration(
+        7, "broadcast_lease",
+        statements=[
+            "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS runner_id VARCHAR(64)",
+            "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ",
+        ],
+    ),
+    Migration(
+        8, "broadcast_notify_chat",
+        statements=[
+            "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS notify_chat_id BIGINT",
+        ],
+    ),
+]
+
+
+class MigrationError(Exception):
+    pass
+
+
+async def _ensure_version_table(conn):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(100) NOT NULL, "
+        "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    ))
+
+
+async def current_version(conn):
+    await _ensure_version_table(conn)
+    return (await conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version"))).scalar()
+
+
+async def upgrade(engine, target=None):
+    # Применяет недостающие миграции, каждую в своей транзакции. Возвращает список применённых
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        async with engine.begin() as conn:
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+            if await current_version(conn) >= migration.version:
+                continue
+            logger.info("Applying migration %d_%s", migration.version, migration.name)
+            if migration.run_sync is not None:
+                await conn.run_sync(migration.run_sync)
+            for statement in migration.statements:
+                await conn.execute(text(statement))
+            await conn.execute(
+                text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                {'version': migration.version, 'name': migration.name},
+            )
+        applied.append(migration)
+    return applied
+
+
+def _index_names(plan):
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', ()):
+        names |= _index_names(child)
+    return names
+
+
+async def check_plans(engine, migrations=None):
+    # Проверка планов горячих запросов. Seq scan отключается: на маленьких
+    # таблицах планировщик и так выберет его, а нам важно, что индекс применим.
+    # Возвращает список (migration, check, использованные индексы) для провалившихся.
+    failures = []
+    for migration in migrations if migrations is not None else MIGRATIONS:
+        for check in migration.checks:
+            async with engine.begin() as conn:
+                await conn.execute(text("SET LOCAL enable_seqscan = off"))
+                raw = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {check.query}"))).scalar()
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+            used = _index_names(plan)
+            if check.index not in used:
+                failures.append((migration, check, used))
+    return failures
+
+
+async def migrate(engine):
+    # Вызывается при старте: миграции + проверка планов для только что применённых
+    applied = await upgrade(engine)
+    if applied:
+        for migration, check, used in await check_plans(engine, applied):
+            logger.error("Migration %d_%s: query %r does not use %s (uses %s)",
+                         migration.version, migration.name, check.query, check.index, sorted(used) or 'no index')
+
+
+async def _main(command):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from config import Settings
+
+    engine = create_async_engine(Settings.from_env().database_url)
+    try:
+        if command == 'upgrade':
+            for migration in await upgrade(engine):
+                print(f"Applied {migration.version}_{migration.name}")
+        elif command == 'status':
+            async with engine.begin() as conn:
+                version = await current_version(conn)
+            print(f"Schema version {version}, latest {MIGRATIONS[-1].version}")
+        elif command == 'check':
+            failures = await check_plans(engine)
+            for migration, check, used in failures:
+                print(f"FAIL {migration.version}_{migration.name}: {check.query!r} "
+                      f"does not use {check.index} (uses {sorted(used) or 'no index'})")
+            if failures:
+                return 1
+            print("All query plans use the expected indexes")
+        else:
+            print("Usage: python -m database.migrations [upgrade|status|check]")
+            return 2
+    finally:
+        await engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else 'upgrade')))
@@ -0,0 +1,77 @@
+import heapq
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+
+@dataclass
+class PendingPayment:
+    id: int
+    user_id: int
+    ccy: str
+    crypto_amount: float
+    crypto_rate: float
+    payment_window_end: datetime
+    transaction_hash: str = None
+
+
+class PendingPaymentIndex:
+    # Живые ожидающие платежи (PaymentInfo.status == 'pending') в памяти процесса:
+    # последний платёж пользователя по user_id и платёж по хэшу транзакции.
+    # Запись пропадает в момент payment_window_end: истёкшие снимаются при каждом
+    # add() и len(), так что индекс не растёт и без фоновой задачи в этом воркере.
+    # Индекс локален для процесса, поэтому промах - не ответ "платежа нет", а повод сходить в БД.
+
+    def __init__(self):
+        self._by_user = {}  # user_id -> PendingPayment
+        self._by_hash = {}  # transaction_hash -> PendingPayment
+        self._deadlines = []  # (payment_window_end, id, PendingPayment)
+
+    def __len__(self):
+        self.purge()
+        return len(self._by_user)
+
+    def add(self, payment):
+        self.purge()
+        self.remove(payment.user_id)
+        self._by_user[payment.user_id] = payment
+        if payment.transaction_hash:
+            self._by_hash[payment.transaction_hash] = payment
+        heapq.heappush(self._deadlines, (payment.payment_window_end, payment.id, payment))
+
+    def set_hash(self, payment, transaction_hash):
+        if payment.transaction_hash:
+            self._by_hash.pop(payment.transaction_hash, None)
+        payment.transaction_hash = transaction_hash
+        if transaction_hash:
+            self._by_hash[transaction_hash] = payment
+
+    def by_user(self, user_id):
+        return self._live(self._by_user.get(user_id))
+
+    def by_hash(self, transaction_hash):
+        return self._live(self._by_hash.get(transaction_hash))
+
+    def remove(self, user_id):
+        payment = self._by_user.pop(user_id, None)
+        if payment is not None and payment.transaction_hash:
+            self._by_hash.pop(payment.transaction_hash, None)
+        return payment
+
+    def purge(self, now=None):
+        # Снимаем платежи с истёкшим окном; в куче могут лежать уже удалённые записи
+        now = now or datetime.now(timezone.utc)
+        expired = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, payment = heapq.heappop(self._deadlines)
+            if self._by_user.get(payment.user_id) is payment:
+                self.remove(payment.user_id)
+                expired += 1
+        return expired
+
+    def _live(self, payment):
+        if payment is None:
+            return None
+        if payment.payment_window_end <= datetime.now(timezone.utc):
+            self.remove(payment.user_id)
+            return None
+        return payment
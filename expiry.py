@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone
+
+import database.database as db
+
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    # Планировщик истечения подписок. В куче лежат только подписки, истекающие
+    # в ближайший horizon; окно подгружается из БД инкрементально по индексу
+    # subscription_end. Продления сообщаются через notify() (db.subscription_listeners).
+    # Неудачные удаления возвращаются в кучу с экспоненциальной задержкой, а раз в
+    # sweep_interval идёт полная чистка remove_expired_users() как страховка.
+
+    def __init__(self, horizon=timedelta(hours=1), max_sleep=60, retry_base=30, retry_max=3600,
+                 sweep_interval=timedelta(hours=6)):
+        self.horizon = horizon
+        self.max_sleep = max_sleep
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.sweep_interval = sweep_interval
+        self._heap = []  # (timestamp окончания, user_id)
+        self._due = {}  # user_id -> актуальный timestamp окончания в окне
+        self._attempts = {}  # user_id -> число неудачных попыток удаления
+        self._loaded_until = None
+        self._next_sweep = None
+        self._wakeup = asyncio.Event()
+
+    def notify(self, user_id, subscription_end):
+        self._attempts.pop(user_id, None)
+        if self._loaded_until is None:
+            return
+        if subscription_end is None or subscription_end >= self._loaded_until:
+            # Подписка удалена или продлена за пределы окна - загрузится при следующем окне
+            self._due.pop(user_id, None)
+            return
+        self._schedule(user_id, subscription_end)
+        self._wakeup.set()
+
+    def _schedule(self, user_id, subscription_end):
+        timestamp = subscription_end.timestamp()
+        self._due[user_id] = timestamp
+        heapq.heappush(self._heap, (timestamp, user_id))
+
+    async def _load_window(self, now):
+        start = self._loaded_until
+        until = now + self.horizon
+        loaded = 0
+        async for user_id, subscription_end in db.get_expiring_subscriptions(start, until):
+            self._schedule(user_id, subscription_end)
+            loaded += 1
+        self._loaded_until = until
+        logger.info("Expiry window loaded up to %s (%d subscriptions)", until.isoformat(), loaded)
+
+    def _pop_due(self, now_ts):
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            timestamp, user_id = heapq.heappop(self._heap)
+            # Устаревшие записи (после продления) пропускаем
+            if self._due.get(user_id) == timestamp:
+                del self._due[user_id]
+                due.append(user_id)
+        return due
+
+    def _retry(self, user_ids, now_ts):
+        # Повтор с задержкой retry_base * 2^n, не больше retry_max
+        for user_id in user_ids:
+            attempts = self._attempts.get(user_id, 0) + 1
+            self._attempts[user_id] = attempts
+            delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            self._schedule(user_id, datetime.fromtimestamp(now_ts + delay, timezone.utc))
+
+    async def _expire_due(self, now_ts):
+        due = self._pop_due(now_ts)
+        if not due:
+            return
+        try:
+            removed, failed = await db.expire_users(due)
+        except Exception as e:
+            # Ничего не удалено - все пользователи возвращаются в очередь
+            logger.warning("Failed to expire %d subscriptions: %s", len(due), e)
+            self._retry(due, now_ts)
+            return
+        failed_set = set(failed)
+        for user_id in due:
+            if user_id not in failed_set:
+                self._attempts.pop(user_id, None)
+        if failed:
+            self._retry(failed, now_ts)
+        logger.info("Expired %d of %d due subscriptions, %d to retry", removed, len(due), len(failed))
+
+    async def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        try:
+            await db.remove_expired_users()
+        except Exception as e:
+            logger.warning("Expired subscriptions sweep failed: %s", e)
+
+    async def run(self):
+        # Всё, что истекло пока бот не работал, удаляем полной чисткой
+        now = datetime.now(timezone.utc)
+        await self._sweep(now)
+        self._loaded_until = now
+
+        while True:
+            try:
+                now = datetime.now(timezone.utc)
+                # Подгружаем следующее окно заранее, на половине горизонта
+                if self._loaded_until - now <= self.horizon / 2:
+                    await self._load_window(now)
+
+                await self._expire_due(now.timestamp())
+
+                if now >= self._next_sweep:
+                    await self._sweep(now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Expiry scheduler error: %s", e)
+
+            now_ts = datetime.now(timezone.utc).timestamp()
+            sleep_for = self.max_sleep
+            if self._heap:
+                sleep_for = min(sleep_for, max(self._heap[0][0] - now_ts, 0))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
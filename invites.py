@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import database.database as db
+import telegram_gateway
+
+
+logger = logging.getLogger(__name__)
+
+
+class InviteLinkPool:
+    # Запас одноразовых (member_limit=1) ссылок в канал с ограниченным сроком жизни.
+    # Выдача ссылки после оплаты - взять из очереди, без запроса к Telegram;
+    # пополнение до size идёт в фоне, когда запас падает ниже low_water.
+    # Кому выдана ссылка, пишется в invite_links (пачками, вне пути пользователя).
+    # Невыданные ссылки отзываются при остановке.
+
+    def __init__(self, bot, channel_id, size=10, low_water=3, ttl=timedelta(days=7),
+                 min_remaining=timedelta(hours=24), check_interval=timedelta(hours=1)):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.size = size
+        self.low_water = low_water
+        self.ttl = ttl
+        # Ссылку, которой осталось жить меньше, не выдаём: пользователь может открыть её
+        # не сразу. Не больше половины ttl, иначе свежие ссылки сразу уходили бы в отбраковку
+        self.min_remaining = min(min_remaining, ttl / 2)
+        self.check_interval = check_interval
+        self._links = deque()  # (invite_link, expire_date)
+        self._issued = []  # (invite_link, user_id, issued_at) для записи в БД
+        self._refill = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._links)
+
+    async def start(self):
+        if self._task is None:
+            self._refill.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush_issued()
+        await self._revoke_unused()
+
+    async def take(self, user_id):
+        now = datetime.now(timezone.utc)
+        link = None
+        while self._links:
+            candidate, expire_date = self._links.popleft()
+            if expire_date - now >= self.min_remaining:
+                link = candidate
+                break
+        if len(self._links) < self.low_water:
+            self._refill.set()
+        if link is None:
+            # Запас пуст - создаём ссылку сразу, как раньше
+            link, _ = await self._mint()
+        self._issued.append((link, user_id, now))
+        return link
+
+    async def _mint(self):
+        expire_date = datetime.now(timezone.utc) + self.ttl
+        result = await self.bot.create_chat_invite_link(
+            self.channel_id, member_limit=1, expire_date=expire_date, name="pool"
+        )
+        await db.record_invite_links([(result.invite_link, expire_date)])
+        return result.invite_link, expire_date
+
+    async def _run(self):
+        # Пополнение запаса не должно отнимать слоты у ответов пользователям
+        with telegram_gateway.lane(telegram_gateway.BULK):
+            await self._refill_loop()
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                # Срок жизни запаса проверяем хотя бы раз в check_interval
+                await asyncio.wait_for(self._refill.wait(), self.check_interval.total_seconds())
+            except asyncio.TimeoutError:
+                pass
+            self._refill.clear()
+            await self._flush_issued()
+            self._drop_expiring()
+            while len(self._links) < self.size:
+                try:
+                    self._links.append(await self._mint())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Failed to mint invite link: %s", e)
+                    await asyncio.sleep(5)
+
+    def _drop_expiring(self):
+        now = datetime.now(timezone.utc)
+        # Ссылки создаются по порядку, поэтому истекающие - в начале очереди
+        while self._links and self._links[0][1] - now < self.min_remaining:
+            self._links.popleft()
+
+    async def _flush_issued(self):
+        if not self._issued:
+            return
+        issued, self._issued = self._issued, []
+        try:
+            await db.mark_invites_issued(issued)
+        except Exception as e:
+            self._issued.extend(issued)
+            logger.warning("Failed to record %d issued invite links: %s", len(issued), e)
+
+    async def _revoke_unused(self):
+        revoked = []
+        while self._links:
+            link, _ = self._links.popleft()
+            try:
+                await self.bot.revoke_chat_invite_link(self.channel_id, link)
+                revoked.append(link)
+            except Exception as e:
+                logger.warning("Failed to revoke invite link: %s", e)
+        if revoked:
+            try:
+                await db.mark_invites_revoked(revoked)
+            except Exception as e:
+                logger.warning("Failed to record revoked invite links: %s", e)
@@ -1,5 +1,21 @@
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from plans import COINS, PLANS
+
+
+# Структурированные callback_data: prefix:action:plan:currency
+class MenuCallback(CallbackData, prefix='menu'):
+    action: str  # channels, public, private, plans, plan
+    plan: int = 0
+
+
+class PaymentCallback(CallbackData, prefix='pay'):
+    action: str  # intro, start, paid, cancel, stars, da, tg
+    plan: int = 0
+    currency: str = ''
+
+
 main = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text='Subscriptions 💵'),
                                       KeyboardButton(text='My subscription ⏳')],
                                      [KeyboardButton(text='Support ⚙️'),
@@ -8,71 +24,65 @@ main = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text='Subscriptions 💵'),
                             input_field_placeholder='Select menu item...')
 
 subscriptions = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='Premium access on month 💎', callback_data='prem on month')],
-    [InlineKeyboardButton(text='Premium access on 3 months 💎', callback_data='prem on 3 months')]])
+    [InlineKeyboardButton(text=f'Premium access on {"month" if plan.months == 1 else f"{plan.months} months"} 💎',
+                          callback_data=MenuCallback(action='plan', plan=plan.months).pack())]
+    for plan in PLANS.values()])
 
 channels = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='Public channel 💎', callback_data='public channel')],
-    [InlineKeyboardButton(text='Private channel 💎', callback_data='private channel')]])
+    [InlineKeyboardButton(text='Public channel 💎', callback_data=MenuCallback(action='public').pack())],
+    [InlineKeyboardButton(text='Private channel 💎', callback_data=MenuCallback(action='private').pack())]])
 
 backtomenu = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back to menu channels')]])
-
-
-payment1 = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='🌎 Via telegram', callback_data='paymentTG')],
-    [InlineKeyboardButton(text='🌎 Crypto: USDT(TRC20)', callback_data='paymentTRC20')],
-    [InlineKeyboardButton(text='🌎 Crypto: Toncoin(TON)', callback_data='paymentTON')],
-    [InlineKeyboardButton(text='🌎 Crypto: Litecoin(LTC)', callback_data='paymentLTC')],
-    [InlineKeyboardButton(text='🌎 Telegram stars ⭐️', callback_data='TelegramStars')],
-    [InlineKeyboardButton(text='🌎 Donation Alerts', callback_data='DonationAlerts')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back to menu')]])
-payment2 = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='🌎 Via telegram', callback_data='paymentTG')],
-    [InlineKeyboardButton(text='🌎 Crypto: USDT(TRC20)', callback_data='paymentTRC20(2)')],
-    [InlineKeyboardButton(text='🌎 Crypto: Toncoin(TON)', callback_data='paymentTON(2)')],
-    [InlineKeyboardButton(text='🌎 Crypto: Litecoin(LTC)', callback_data='paymentLTC(2)')],
-    [InlineKeyboardButton(text='🌎 Telegram stars ⭐️', callback_data='TelegramStars(2)')],
-    [InlineKeyboardButton(text='🌎 Donation Alerts', callback_data='DonationAlerts(2)')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back to menu')]])
-
-
-paymentbutton = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='✅ I paid', callback_data='I paid')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from payment')]])
-paymentbutton2 = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='✅ I paid', callback_data='I paid')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from payment(2)')]])
-
-
-
-
+    [InlineKeyboardButton(text='🔙Back to menu', callback_data=MenuCallback(action='channels').pack())]])
 
 buyfromsubscription = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='✅Buy premium', callback_data='buy from sub')]])
-
-LTCpay = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='⏳ Start payment', callback_data='cryptopayLTC')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from payment')]])
-
-LTCpay2 = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='⏳ Start payment', callback_data='cryptopayLTC(2)')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from payment(2)')]])
-
-TONpay = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='⏳ Start payment', callback_data='cryptopayTON')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from payment')]])
-
-TONpay2 = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='⏳ Start payment', callback_data='cryptopayTON(2)')],
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from payment(2)')]])
-
-cryptopay_exit = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='✅ I paid', callback_data='cryptopaybutton')],
-    [InlineKeyboardButton(text='❌Cancel payment', callback_data='cryptocancelpayment')]])
-
-DA_donate = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from paymentDA')]])
-
-DA_donate2 = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text='🔙Back to menu', callback_data='back from paymentDA(2)')]])
\ No newline at end of file
+    [InlineKeyboardButton(text='✅Buy premium', callback_data=MenuCallback(action='plans').pack())]])
+
+
+def _back_to_plan(months):
+    return InlineKeyboardButton(text='🔙Back to menu', callback_data=MenuCallback(action='plan', plan=months).pack())
+
+
+# Способы оплаты для тарифа: months -> markup
+payment = {
+    plan.months: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='🌎 Via telegram', callback_data=PaymentCallback(action='tg', plan=plan.months).pack())],
+        *[[InlineKeyboardButton(text=f'🌎 Crypto: {coin.name}',
+                                callback_data=PaymentCallback(action='intro', plan=plan.months, currency=coin.currency).pack())]
+          for coin in COINS.values()],
+        [InlineKeyboardButton(text='🌎 Telegram stars ⭐️', callback_data=PaymentCallback(action='stars', plan=plan.months).pack())],
+        [InlineKeyboardButton(text='🌎 Donation Alerts', callback_data=PaymentCallback(action='da', plan=plan.months).pack())],
+        [InlineKeyboardButton(text='🔙Back to menu', callback_data=MenuCallback(action='plans').pack())]])
+    for plan in PLANS.values()
+}
+
+
+def _intro_keyboard(coin, months):
+    if coin.with_payment:
+        first = InlineKeyboardButton(text='⏳ Start payment',
+                                     callback_data=PaymentCallback(action='start', plan=months, currency=coin.currency).pack())
+    else:
+        first = InlineKeyboardButton(text='✅ I paid',
+                                     callback_data=PaymentCallback(action='paid', plan=months, currency=coin.currency).pack())
+    return InlineKeyboardMarkup(inline_keyboard=[[first], [_back_to_plan(months)]])
+
+
+# Клавиатура под инструкцией по оплате: (currency, months) -> markup
+payment_intro = {
+    (coin.currency, plan.months): _intro_keyboard(coin, plan.months)
+    for coin in COINS.values()
+    for plan in PLANS.values()
+}
+
+# После начала оплаты: currency -> markup
+cryptopay_exit = {
+    coin.currency: InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='✅ I paid', callback_data=PaymentCallback(action='paid', currency=coin.currency).pack())],
+        [InlineKeyboardButton(text='❌Cancel payment', callback_data=PaymentCallback(action='cancel', currency=coin.currency).pack())]])
+    for coin in COINS.values()
+}
+
+DA_donate = {
+    plan.months: InlineKeyboardMarkup(inline_keyboard=[[_back_to_plan(plan.months)]])
+    for plan in PLANS.values()
+}
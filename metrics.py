@@ -0,0 +1,272 @@
+import asyncio
+import bisect
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+import database.database as db
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм латентности, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function  # значение без меток, снимается при каждом запросе /metrics
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                self._values[()] = self.function()
+            except Exception as e:
+                logger.warning("Gauge %s failed: %s", self.name, e)
+        return super().samples()
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [counts по корзинам + Inf, sum]
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        names = self.labelnames + ('le',)
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _labels(names, labels + (bound,)), cumulative
+            yield f'{self.name}_sum', _labels(self.labelnames, labels), total
+            yield f'{self.name}_count', _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []  # функции, возвращающие готовые строки экспозиции
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', 'Handler processing time', ('event', 'handler')))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Handlers that raised', ('event', 'handler')))
+TELEGRAM_LATENCY = REGISTRY.register(Histogram(
+    'bot_telegram_request_duration_seconds', 'Telegram Bot API call time', ('method',)))
+TELEGRAM_RETRY_AFTER = REGISTRY.register(Counter(
+    'bot_telegram_retry_after_total', 'Telegram 429 (RetryAfter) responses', ('method',)))
+TELEGRAM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_telegram_queue_depth', 'Requests waiting in the outbound Telegram gateway', ('lane',)))
+TELEGRAM_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'bot_telegram_queue_wait_seconds', 'Time spent waiting for a Telegram rate-limit slot', ('lane',)))
+OKX_LAG = REGISTRY.register(Histogram(
+    'bot_okx_deposit_lag_seconds', 'Deposit ts to websocket receive time',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)))
+OKX_DEPOSITS = REGISTRY.register(Counter(
+    'bot_okx_deposits_total', 'Deposits decoded from OKX', ('source',)))
+OKX_RECONNECTS = REGISTRY.register(Counter(
+    'bot_okx_reconnects_total', 'OKX websocket reconnect attempts'))
+RATE_FETCH_LATENCY = REGISTRY.register(Histogram(
+    'bot_rate_fetch_duration_seconds', 'CoinMarketCap quotes request time'))
+RATE_CACHE = REGISTRY.register(Counter(
+    'bot_rate_cache_requests_total', 'Rate lookups by cache result', ('result',)))
+
+
+def _ratio(hits, misses):
+    total = hits + misses
+    return hits / total if total else 0
+
+
+RATE_CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    'bot_rate_cache_hit_ratio', 'Share of rate lookups served without a CMC request',
+    function=lambda: _ratio(RATE_CACHE.value('hit') + RATE_CACHE.value('history'), RATE_CACHE.value('miss'))))
+SUBSCRIPTION_CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    'bot_subscription_cache_hit_ratio', 'Share of get_subscription calls served from cache',
+    function=lambda: _ratio(db.subscription_cache.hits, db.subscription_cache.misses)))
+PENDING_PAYMENTS = REGISTRY.register(Gauge(
+    'bot_pending_payments', 'Live pending crypto payments in this process',
+    function=lambda: len(db.pending_payments)))
+INVITE_POOL = REGISTRY.register(Gauge(
+    'bot_invite_pool_links', 'Pre-minted invite links ready to hand out',
+    function=lambda: len(db.invite_pool) if db.invite_pool is not None else 0))
+
+
+def _callback_label(callback):
+    # menu:plans:0 -> menu:plans; все callback идут через один хэндлер CallbackDispatcher
+    return ':'.join((callback.data or '?').split(':', 2)[:2])
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренняя middleware: data['handler'] уже известен, время считается только для хэндлера
+
+    def __init__(self, event_name):
+        self.event_name = event_name
+
+    async def __call__(self, handler, event, data):
+        if self.event_name == 'callback_query':
+            name = _callback_label(event)
+        else:
+            name = getattr(data.get('handler'), 'callback', handler).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(self.event_name, name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, self.event_name, name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            TELEGRAM_RETRY_AFTER.inc(name)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, name)
+
+
+def install(dp, bot, db_stats):
+    # Внутренние middleware диспетчера действуют и во вложенных роутерах
+    for event_name in ('message', 'callback_query', 'pre_checkout_query'):
+        dp.observers[event_name].middleware(HandlerMetricsMiddleware(event_name))
+    bot.session.middleware(TelegramMetricsMiddleware())
+    REGISTRY.add_collector(db_stats_collector(db_stats))
+
+
+def db_stats_collector(db_stats):
+    # Перевод DBStats (мс) в экспозицию Prometheus (секунды)
+    def collect():
+        snapshot = db_stats.snapshot()
+        lines = [
+            '# HELP bot_db_query_duration_seconds SQL statement time by statement kind',
+            '# TYPE bot_db_query_duration_seconds histogram',
+        ]
+        for key, histogram in snapshot['statements'].items():
+            lines.extend(_histogram_lines('bot_db_query_duration_seconds', f'statement="{key}"', histogram))
+        lines.append('# HELP bot_db_pool_checkout_wait_seconds Time waiting for a pooled connection')
+        lines.append('# TYPE bot_db_pool_checkout_wait_seconds histogram')
+        lines.extend(_histogram_lines('bot_db_pool_checkout_wait_seconds', '', snapshot['checkout_wait']))
+        lines.append('# TYPE bot_db_errors_total counter')
+        lines.append(f"bot_db_errors_total {snapshot['errors']}")
+        for name, value in snapshot['pool'].items():
+            lines.append(f'# TYPE bot_db_pool_{name} gauge')
+            lines.append(f'bot_db_pool_{name} {value}')
+        return lines
+    return collect
+
+
+def _histogram_lines(name, labels, histogram):
+    prefix = f'{labels},' if labels else ''
+    braces = f'{{{labels}}}' if labels else ''
+    cumulative = 0
+    for bound_ms, count in histogram['buckets'].items():
+        cumulative += count
+        bound = '+Inf' if bound_ms == float('inf') else bound_ms / 1000
+        yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+    yield f"{name}_sum{braces} {histogram['sum_ms'] / 1000}"
+    yield f"{name}_count{braces} {histogram['count']}"
+
+
+async def run_metrics_server(host, port):
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    try:
+        await site.start()
+    except OSError as e:
+        # Порт занят (например, другим воркером) - бот работает и без метрик
+        logger.error("Metrics server on %s:%s failed to start: %s", host, port, e)
+        await runner.cleanup()
+        return
+    logger.info("Metrics available on http://%s:%s/metrics", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
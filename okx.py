@@ -0,0 +1,294 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import websockets
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+OKX_WS_URL = "wss://ws.okx.com:8443/ws/v5/business"
+OKX_REST_URL = "https://www.okx.com"
+DEPOSIT_HISTORY_PATH = "/api/v5/asset/deposit-history"
+# Состояния депозита, которые ещё могут смениться: 0 - ждёт подтверждений,
+# 1 - зачислен без права вывода, 8 - приостановлен. Остальные окончательные
+UNSETTLED_STATES = (0, 1, 8)
+
+
+def create_signature(secret_key, timestamp, method, requestPath, body=''):
+    if body == '{}' or body is None:
+        body = ''
+    message = f'{timestamp}{method}{requestPath}{body}'
+    mac = hmac.new(bytes(secret_key, encoding='utf-8'), bytes(message, encoding='utf-8'), digestmod=hashlib.sha256)
+    return base64.b64encode(mac.digest()).decode('utf-8')
+
+
+def parse_deposit(deposit):
+    # Проверка и приведение типов полей депозита OKX (websocket и REST одинаковы)
+    txId = deposit.get('txId')
+    amount = deposit.get('amt')
+    state = deposit.get('state')
+    timestamp = deposit.get('ts')
+    currency = deposit.get('ccy')
+
+    if not txId:
+        print("Invalid txId format")
+        return None
+
+    try:
+        amount = float(amount)
+    except (ValueError, TypeError):
+        print("Invalid amount format")
+        return None
+
+    if not isinstance(state, str) or not state.isdigit():
+        print("Invalid state format")
+        return None
+
+    try:
+        ts_ms = int(timestamp)
+        timestamp = datetime.fromtimestamp(ts_ms / 1000)  # Преобразование в секунды
+    except (ValueError, TypeError):
+        print("Invalid timestamp format")
+        return None
+
+    return {
+        'transaction_hash': txId,
+        'amount': amount,
+        'state': int(state),
+        'timestamp': timestamp,
+        'currency': currency,
+        'ts_ms': ts_ms,
+    }
+
+
+class OKXDepositStream:
+    # Поток депозитов OKX (канал deposit-info) с автоматическим переподключением.
+    # После каждого (пере)подключения депозиты, пропущенные за время простоя,
+    # дочитываются через REST, начиная с самого старого ещё не завершённого депозита:
+    # его смена статуса могла прийти как раз во время простоя. Разобранные депозиты идут в ограниченную очередь,
+    # поэтому медленная запись в БД не блокирует чтение из сокета, а притормаживает его.
+    # Потребитель копит депозиты до batch_size штук или batch_linger секунд
+    # и отдаёт их в on_deposits одной пачкой; неудачная пачка повторяется.
+
+    def __init__(self, api_key, secret_key, passphrase, uid, on_deposits, queue_size=1000,
+                 batch_size=200, batch_linger=0.05, ping_interval=10, max_backoff=60,
+                 unsettled_max_age=timedelta(hours=24)):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.passphrase = passphrase
+        self.uid = uid
+        self.on_deposits = on_deposits
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger
+        self.ping_interval = ping_interval
+        self.max_backoff = max_backoff
+        self.unsettled_max_age = unsettled_max_age
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._last_ts = None  # ts (мс) последнего полученного депозита
+        self._unsettled = {}  # txId -> ts (мс) депозитов в незавершённом состоянии
+        self._connected = False
+
+    async def run(self):
+        consumer = asyncio.create_task(self._consume())
+        backoff = 1
+        try:
+            while True:
+                try:
+                    await self._connect()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("OKX stream error: %s", e)
+                if self._connected:
+                    # Соединение успело авторизоваться - начинаем задержку заново
+                    self._connected = False
+                    backoff = 1
+                metrics.OKX_RECONNECTS.inc()
+                delay = backoff + random.uniform(0, backoff / 2)
+                logger.info("Reconnecting to OKX in %.1f s", delay)
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+        finally:
+            consumer.cancel()
+
+    async def _connect(self):
+        async with websockets.connect(OKX_WS_URL, open_timeout=15, ping_timeout=None, ping_interval=None) as websocket:
+            logger.info("WebSocket connection established")
+            await self._login(websocket)
+            await self._subscribe(websocket)
+            self._connected = True
+
+            # Догоняем депозиты, пришедшие пока соединения не было
+            await self._backfill()
+
+            reader = asyncio.create_task(self._read(websocket))
+            pinger = asyncio.create_task(self._ping(websocket))
+            try:
+                done, _ = await asyncio.wait({reader, pinger}, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            finally:
+                reader.cancel()
+                pinger.cancel()
+
+    async def _login(self, websocket):
+        timestamp = str(int(datetime.now(timezone.utc).timestamp()))
+        signature = create_signature(self.secret_key, timestamp, 'GET', '/users/self/verify')
+        login_message = {
+            "op": "login",
+            "args": [
+                {
+                    "apiKey": self.api_key,
+                    "passphrase": self.passphrase,
+                    "timestamp": timestamp,
+                    "sign": signature,
+                }
+            ]
+        }
+        await websocket.send(json.dumps(login_message))
+        response = json.loads(await websocket.recv())
+        logger.info("Authentication response: %s", response)
+        if response.get('event') != 'login' or str(response.get('code')) != '0':
+            raise ConnectionError(f"OKX login failed: {response}")
+
+    async def _subscribe(self, websocket):
+        subscribe_message = {
+            "op": "subscribe",
+            "args": [
+                {
+                    "channel": "deposit-info",
+                    "uid": self.uid
+                }
+            ]
+        }
+        await websocket.send(json.dumps(subscribe_message))
+        response = json.loads(await websocket.recv())
+        logger.info("Subscription response: %s", response)
+        if response.get('event') == 'error':
+            raise ConnectionError(f"OKX subscribe failed: {response}")
+
+    async def _ping(self, websocket):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            pong = await websocket.ping()
+            # Нет pong - соединение мёртвое, выходим и переподключаемся
+            await asyncio.wait_for(pong, timeout=self.ping_interval)
+
+    async def _read(self, websocket):
+        while True:
+            response = await websocket.recv()
+            try:
+                data = json.loads(response)
+            except json.JSONDecodeError as e:
+                logger.warning("JSON Decode Error: %s", e)
+                continue
+            if data.get('event') == 'error':
+                raise ConnectionError(f"OKX error: {data}")
+            for deposit in data.get('data', ()):
+                await self._enqueue(deposit, 'websocket')
+
+    async def _enqueue(self, raw, source):
+        deposit = parse_deposit(raw)
+        if deposit is None:
+            return
+        metrics.OKX_DEPOSITS.inc(source)
+        if source == 'websocket':
+            # Задержка доставки события: ts депозита на OKX против времени приёма
+            metrics.OKX_LAG.observe(max(0.0, datetime.now(timezone.utc).timestamp() - deposit['ts_ms'] / 1000))
+        if self._last_ts is None or deposit['ts_ms'] > self._last_ts:
+            self._last_ts = deposit['ts_ms']
+        if deposit['state'] in UNSETTLED_STATES:
+            self._unsettled[deposit['transaction_hash']] = deposit['ts_ms']
+        else:
+            self._unsettled.pop(deposit['transaction_hash'], None)
+        await self.queue.put(deposit)
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_linger
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _deliver(self, batch):
+        # Пачку не теряем: повторяем с задержкой, пока запись не пройдёт.
+        # Тем временем очередь заполняется и притормаживает чтение из сокета
+        backoff = 1
+        while True:
+            try:
+                await self.on_deposits(batch)
+                return
+            except Exception as e:
+                logger.warning("Failed to store %d deposits, retrying in %d s: %s", len(batch), backoff, e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _backfill_cursor(self):
+        # Граница дочитки: последний увиденный депозит или самый старый незавершённый,
+        # если он моложе unsettled_max_age (более старые считаем брошенными)
+        if self._last_ts is None:
+            return None
+        cutoff = (datetime.now(timezone.utc) - self.unsettled_max_age).timestamp() * 1000
+        for txId, ts_ms in list(self._unsettled.items()):
+            if ts_ms < cutoff:
+                del self._unsettled[txId]
+        # before строгий (ts > before), поэтому -1: граничный депозит тоже перечитываем
+        return min(self._last_ts, *self._unsettled.values()) - 1
+
+    async def _backfill(self):
+        # REST: депозиты новее границы дочитки, страницами по 100
+        params = {'limit': '100'}
+        cursor = self._backfill_cursor()
+        if cursor is not None:
+            params['before'] = str(cursor)
+        total = 0
+        async with aiohttp.ClientSession(base_url=OKX_REST_URL, timeout=aiohttp.ClientTimeout(total=15)) as session:
+            while True:
+                page = await self._get_deposit_history(session, params)
+                for raw in page:
+                    await self._enqueue(raw, 'backfill')
+                total += len(page)
+                if len(page) < 100 or cursor is None:
+                    break
+                # Записи отдаются от новых к старым: следующая страница - старее самой старой
+                params['after'] = min(raw['ts'] for raw in page)
+        if total:
+            logger.info("Backfilled %d deposits from OKX REST", total)
+
+    async def _get_deposit_history(self, session, params):
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        request_path = f"{DEPOSIT_HISTORY_PATH}?{query}"
+        timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+        headers = {
+            'OK-ACCESS-KEY': self.api_key,
+            'OK-ACCESS-SIGN': create_signature(self.secret_key, timestamp, 'GET', request_path),
+            'OK-ACCESS-TIMESTAMP': timestamp,
+            'OK-ACCESS-PASSPHRASE': self.passphrase,
+        }
+        async with session.get(request_path, headers=headers) as response:
+            response.raise_for_status()
+            payload = await response.json()
+        if str(payload.get('code')) != '0':
+            raise ConnectionError(f"OKX deposit-history failed: {payload}")
+        return payload.get('data', [])
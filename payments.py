@@ -0,0 +1,138 @@
+import database.database as db
+import keyboards as kb
+import templates
+
+from aiogram import Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, Message
+
+from callbacks import callback_dispatcher
+from plans import COINS, PAYMENT_METHODS
+from settlement import settlement_reply
+
+
+router = Router()
+
+
+class TransactionState(StatesGroup):
+    waiting_for_hash = State()
+    # Используется всеми монетами с PaymentInfo (TON, LTC), имя сохранено ради FSM-записей в БД
+    waiting_for_hash_LTC = State()
+
+
+def _method(callback_data):
+    return PAYMENT_METHODS.get((callback_data.currency, callback_data.plan))
+
+
+@callback_dispatcher.handler(kb.PaymentCallback, 'intro')
+async def show_intro(callback: CallbackQuery, callback_data: kb.PaymentCallback):
+    method = _method(callback_data)
+    await callback.answer('')
+    if method is None:
+        return
+    user_id = callback.from_user.id
+    variant = (method.coin.currency, method.plan.months)
+    name = 'crypto_intro' if method.coin.with_payment else 'direct_intro'
+    await callback.message.edit_text(templates.render(name, variant, user_id=user_id), parse_mode="HTML",
+                                     reply_markup=kb.payment_intro[variant])
+
+
+@callback_dispatcher.handler(kb.PaymentCallback, 'start')
+async def start_payment(callback: CallbackQuery, callback_data: kb.PaymentCallback, ctx):
+    method = _method(callback_data)
+    await callback.answer('')
+    if method is None:
+        return
+    coin, plan = method.coin, method.plan
+    user_id = callback.from_user.id
+    fiat_amount = plan.price
+    # Курс: кэш процесса, затем история курсов в БД, затем CMC
+    try:
+        crypto_rate = await ctx.rates.get_rate(coin.currency)
+    except Exception as e:
+        print(f"Rate lookup for {coin.currency} failed: {e}")
+        crypto_rate = None
+    crypto_amount, payment_window_end = None, None
+    if crypto_rate is not None:
+        crypto_amount, payment_window_end = await db.initiate_payment(coin.currency, user_id, fiat_amount,
+                                                                      crypto_rate, None)
+    if crypto_amount is None:
+        await callback.message.answer("Exchange rate is temporarily unavailable. Please try again in a minute.")
+        return
+    await callback.message.answer(
+        templates.render('crypto_start', (coin.currency, plan.months), user_id=user_id,
+                         crypto_amount=f"{crypto_amount:.8f}", window_end=payment_window_end.strftime('%H:%M:%S')),
+        parse_mode="HTML", reply_markup= kb.cryptopay_exit[coin.currency]
+    )
+
+
+@callback_dispatcher.handler(kb.PaymentCallback, 'paid')
+async def Ipaidbutton(callback: CallbackQuery, callback_data: kb.PaymentCallback, state: FSMContext):
+    coin = COINS.get(callback_data.currency)
+    await callback.answer('Checking the transaction...')
+    # USDT - сумма сразу в $, остальные монеты - через PaymentInfo
+    if coin is not None and not coin.with_payment:
+        await state.set_state(TransactionState.waiting_for_hash)
+    else:
+        await state.set_state(TransactionState.waiting_for_hash_LTC)
+    await callback.message.answer("Enter your transaction hash.")
+
+
+async def answer_settlement(message: Message, state: FSMContext, result: db.SettlementResult, with_payment: bool):
+    await state.clear()  # Завершаем состояние ожидания
+    if result.status in (db.SETTLE_PENDING, db.SETTLE_NOT_FOUND):
+        # Депозит ещё не зачислен (или не дошёл до OKX) - заявка в БД, SettlementWatcher
+        # засчитает его сам, как только придёт событие от OKX
+        if not await db.claim_deposit(result.tx_hash, result.user_id, with_payment):
+            await message.answer(settlement_reply(db.SettlementResult(db.SETTLE_ALREADY_USED, result.tx_hash,
+                                                                      result.user_id)))
+            return
+        if with_payment:
+            payment = db.pending_payments.by_user(result.user_id)
+            if payment is not None:
+                db.pending_payments.set_hash(payment, result.tx_hash)
+        # Депозит мог зачислиться между проверкой и заявкой - тогда событие OKX
+        # уже обработано без неё, проверяем ещё раз
+        pending = result
+        result = await db.verify_and_settle(result.tx_hash, result.user_id, with_payment=with_payment)
+        if result.status in (db.SETTLE_PENDING, db.SETTLE_NOT_FOUND):
+            if pending.status == db.SETTLE_PENDING or result.status == db.SETTLE_PENDING:
+                await message.answer("Transaction in process. Your access will be granted automatically once it's confirmed.")
+            else:
+                await message.answer("Can't find this deposit yet. If you've just sent it, your access will be granted automatically once it arrives.")
+            return
+        await db.release_deposit_claim(result.tx_hash)
+        if result.status == db.SETTLE_ALREADY_USED and result.owner_id == result.user_id:
+            # Уже засчитан этому же пользователю по событию OKX - доступ выдан там
+            return
+
+    if result.status == db.SETTLE_COMPLETED:
+        await db.deliver_access(result.user_id, result.months)
+    else:
+        await message.answer(settlement_reply(result))
+
+
+@router.message(StateFilter(TransactionState.waiting_for_hash, TransactionState.waiting_for_hash_LTC))
+async def process_transaction_hash(message: Message, state: FSMContext):
+    transaction_hash = (message.text or '').strip()
+    user_id = message.from_user.id
+    with_payment = await state.get_state() == TransactionState.waiting_for_hash_LTC.state
+
+    # Хэш USDT(TRC20) проверяем по длине, у TON/LTC форматы разные
+    if not transaction_hash or (not with_payment and len(transaction_hash) != 66):
+        await message.answer("Invalid transaction hash. Try again.")
+        await state.clear()
+        return
+
+    result = await db.verify_and_settle(transaction_hash, user_id, with_payment=with_payment)
+    await answer_settlement(message, state, result, with_payment)
+
+
+@callback_dispatcher.handler(kb.PaymentCallback, 'cancel')
+async def TONpay_cancel(callback: CallbackQuery, callback_data: kb.PaymentCallback):
+    user_id = callback.from_user.id
+    await db.cancel_payment(user_id)
+    await callback.answer('You successfully cancel the payment!')
+    await callback.message.edit_text(templates.render('menu_honey'), reply_markup=kb.subscriptions)
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+
+
+# Тарифы подписки
+@dataclass(frozen=True)
+class Plan:
+    months: int
+    price: int  # Цена в $
+    days: int
+    title: str
+    stars: int  # Цена в Telegram Stars
+    stars_payload: str
+
+
+# Способы оплаты криптовалютой
+@dataclass(frozen=True)
+class Coin:
+    currency: str  # Тикер депозита в OKX (ccy)
+    name: str  # Название для кнопок и сообщений
+    address: str
+    memo: str = None
+    note: str = None  # Дополнительное предупреждение в инструкции
+    # True - платёж через PaymentInfo с фиксированным курсом (TON, LTC),
+    # False - пользователь сразу платит сумму в $ (USDT)
+    with_payment: bool = True
+
+
+PLANS = {
+    1: Plan(months=1, price=6, days=30, title='MONTH', stars=450, stars_payload='support-payment'),
+    3: Plan(months=3, price=15, days=90, title='3 MONTHS', stars=1100, stars_payload='support-payment-2'),
+}
+
+COINS = {
+    'USDT': Coin(currency='USDT', name='USDT(TRC20)',
+                 address='TGsNKiNTHRxMXmymYRzV73TkwidzJLV4Uu', with_payment=False),
+    'TON': Coin(currency='TON', name='Toncoin (TON)',
+                address='EQD5vcDeRhwaLgAvralVC7sJXI-fc2aNcMUXqcx-BQ-OWnOZ', memo='8686668'),
+    'LTC': Coin(currency='LTC', name='Litecoin (LTC)',
+                address='MPaZJcoVdhUeNerRaYKVkcLgxpNwjQPhif',
+                note='⚠️ Deposit via LTC can take around 25-30 minutes. Try to enter you transaction hash after this time.'),
+}
+
+
+@dataclass(frozen=True)
+class PaymentMethod:
+    coin: Coin
+    plan: Plan
+
+
+# Реестр способов оплаты: (currency, months) -> PaymentMethod.
+# Новая монета = одна запись в COINS.
+PAYMENT_METHODS = {
+    (coin.currency, plan.months): PaymentMethod(coin=coin, plan=plan)
+    for coin in COINS.values()
+    for plan in PLANS.values()
+}
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+
+import metrics
+
+
+CMC_QUOTES_URL = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest'
+
+logger = logging.getLogger(__name__)
+
+
+class RateService:
+    # Курсы CoinMarketCap с TTL-кэшем на символ и фоновым обновлением.
+    # Все символы запрашиваются одним batched-запросом quotes/latest, параллельные
+    # запросы при холодном кэше ждут один и тот же запрос к CMC.
+    # on_snapshot(rates, fetched_at) вызывается после каждого успешного запроса
+    # (например, для записи истории курсов в БД). history(symbol) - общий для воркеров
+    # свежий курс (история в БД): при промахе кэша CMC спрашивается, только если его нет.
+    # Фоновое обновление (start(refresh=True)) достаточно одного воркера.
+
+    def __init__(self, api_key, symbols=('TON', 'LTC', 'USDT'), convert='USDT', ttl=120, refresh_interval=300,
+                 on_snapshot=None, history=None):
+        self.api_key = api_key
+        self.symbols = tuple(symbols)
+        self.convert = convert
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.on_snapshot = on_snapshot
+        self.history = history
+        self._cache = {}  # symbol -> (rate, monotonic time of fetch)
+        self._inflight = None  # asyncio.Task текущего batched-запроса
+        self._session = None
+        self._refresh_task = None
+
+    async def start(self, refresh=True):
+        self._ensure_session()
+        if refresh and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _ensure_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={
+                    'Accepts': 'application/json',
+                    'X-CMC_PRO_API_KEY': self.api_key or '',
+                },
+                timeout=aiohttp.ClientTimeout(total=10),
+                connector=aiohttp.TCPConnector(limit=4, ttl_dns_cache=300),
+            )
+        return self._session
+
+    def cached_rate(self, symbol):
+        cached = self._cache.get(symbol)
+        if cached is None:
+            return None
+        rate, fetched_at = cached
+        if time.monotonic() - fetched_at > self.ttl:
+            return None
+        return rate
+
+    async def get_rate(self, symbol):
+        rate = self.cached_rate(symbol)
+        if rate is not None:
+            metrics.RATE_CACHE.inc('hit')
+            return rate
+        if self.history is not None:
+            try:
+                rate = await self.history(symbol)
+            except Exception as e:
+                logger.warning("Rate history lookup for %s failed: %s", symbol, e)
+            if rate is not None:
+                metrics.RATE_CACHE.inc('history')
+                self._cache[symbol] = (rate, time.monotonic())
+                return rate
+        metrics.RATE_CACHE.inc('miss')
+        try:
+            rates = await self._fetch_shared()
+            return rates[symbol]
+        except Exception as e:
+            # Лучше отдать немного устаревший курс, чем сорвать оплату
+            stale = self._cache.get(symbol)
+            if stale is not None:
+                logger.warning("Rate fetch for %s failed (%s), using stale value", symbol, e)
+                return stale[0]
+            raise
+
+    async def _fetch_shared(self):
+        task = self._inflight
+        if task is None:
+            task = asyncio.create_task(self._fetch())
+            self._inflight = task
+            task.add_done_callback(self._clear_inflight)
+        # shield: отмена одного ожидающего хэндлера не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _clear_inflight(self, task):
+        if self._inflight is task:
+            self._inflight = None
+
+    async def _fetch(self):
+        session = self._ensure_session()
+        parameters = {
+            'symbol': ','.join(self.symbols),
+            'convert': self.convert,
+        }
+        started = time.perf_counter()
+        try:
+            async with session.get(CMC_QUOTES_URL, params=parameters) as response:
+                response.raise_for_status()
+                data = await response.json()
+        finally:
+            metrics.RATE_FETCH_LATENCY.observe(time.perf_counter() - started)
+
+        fetched_at = datetime.now(timezone.utc)
+        now = time.monotonic()
+        rates = {}
+        for symbol in self.symbols:
+            quote = data['data'].get(symbol)
+            if quote is None:
+                logger.warning("No quote for %s in CMC response", symbol)
+                continue
+            # При запросе по symbol CMC может вернуть список монет с одинаковым тикером
+            if isinstance(quote, list):
+                quote = quote[0]
+            rates[symbol] = float(quote['quote'][self.convert]['price'])
+            self._cache[symbol] = (rates[symbol], now)
+
+        if self.on_snapshot is not None and rates:
+            try:
+                await self.on_snapshot(rates, fetched_at)
+            except Exception as e:
+                logger.warning("Failed to store rate snapshot: %s", e)
+        return rates
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self._fetch_shared()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Background rate refresh failed: %s", e)
+            await asyncio.sleep(self.refresh_interval)
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+
+import database.database as db
+
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistrar:
+    # Регистрация пользователей /start в фоне: хэндлер только кладёт user_id
+    # в очередь, а запись идёт пачками (INSERT ... ON CONFLICT DO NOTHING)
+    # раз в flush_interval секунд или по набору batch_size новых id.
+    # Уже виденные id отсекаются в памяти и в БД не уходят вовсе.
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_seen=200000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_seen = max_seen
+        self._seen = set()
+        self._pending = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def register(self, user_id):
+        if user_id in self._seen:
+            return
+        if len(self._seen) >= self.max_seen:
+            # Память ограничена; лишний повтор отсечёт ON CONFLICT
+            self._seen.clear()
+        self._seen.add(user_id)
+        self._pending.add(user_id)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, set()
+        try:
+            await db.add_users(batch)
+        except Exception as e:
+            # Вернём в очередь до следующей попытки
+            self._pending |= batch
+            logger.warning("Failed to register %d users: %s", len(batch), e)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
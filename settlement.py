@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+import database.database as db
+import telegram_gateway
+
+
+logger = logging.getLogger(__name__)
+
+DEPOSIT_COMPLETED = 2  # state депозита OKX: зачислен
+
+# Ответ пользователю по результату db.verify_and_settle
+SETTLEMENT_REPLIES = {
+    db.SETTLE_NOT_FOUND: "Can't find this deposit.",
+    db.SETTLE_ALREADY_USED: "This hash has already been used.",
+    db.SETTLE_NO_PAYMENT: "No active payment found.",
+    db.SETTLE_EXPIRED: "The time for payment has expired. Try again/Contact the Admin.",
+    db.SETTLE_INSUFFICIENT: "Insufficient amount. Recheck withdrawal fees/amount.",
+}
+
+
+def settlement_reply(result):
+    if result.status == db.SETTLE_CURRENCY_MISMATCH:
+        return f"Currency mismatch! Expected {result.expected_ccy}, but received {result.ccy}."
+    return SETTLEMENT_REPLIES[result.status]
+
+
+class SettlementWatcher:
+    # Засчитывает оплату в момент, когда OKX сообщает о зачислении депозита (state 2),
+    # без повторной отправки хэша пользователем. Депозит сопоставляется по БД,
+    # поэтому не важно, какой воркер принял хэш или создал платёж:
+    # - по txId, если пользователь уже прислал хэш (db.claim_deposit), пока депозит был в обработке;
+    #   заявки этого же процесса берутся из индекса pending_payments.by_hash;
+    # - по (ccy, сумма), если ровно один ожидающий PaymentInfo ждёт эту сумму.
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._tasks = set()
+
+    async def on_deposits(self, deposits):
+        # Вызывается после записи пачки депозитов в БД
+        completed = [deposit for deposit in deposits if deposit['state'] == DEPOSIT_COMPLETED]
+        if not completed:
+            return
+        # Хэши, заявленные в этом процессе, находятся в индексе ожидающих платежей без запроса
+        unclaimed = [deposit['transaction_hash'] for deposit in completed
+                     if db.pending_payments.by_hash(deposit['transaction_hash']) is None]
+        claims = await db.get_deposit_claims(unclaimed)
+        matches = []
+        for deposit in completed:
+            match = await self._match(deposit, claims)
+            if match is not None:
+                matches.append((deposit['transaction_hash'], *match))
+        for match in matches:
+            # Выдача доступа идёт в Telegram - не задерживаем приём депозитов
+            task = asyncio.create_task(self._settle(*match))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _match(self, deposit, claims):
+        payment = db.pending_payments.by_hash(deposit['transaction_hash'])
+        if payment is not None:
+            return payment.user_id, True, True
+        claim = claims.get(deposit['transaction_hash'])
+        if claim is not None:
+            user_id, with_payment = claim
+            return user_id, with_payment, True
+        user_id = await db.find_payment_by_amount(deposit['currency'], deposit['amount'])
+        if user_id is None:
+            return None
+        return user_id, True, False
+
+    async def _settle(self, tx_hash, user_id, with_payment, claimed):
+        with telegram_gateway.lane(telegram_gateway.PAYMENT):
+            await self._settle_in_lane(tx_hash, user_id, with_payment, claimed)
+
+    async def _settle_in_lane(self, tx_hash, user_id, with_payment, claimed):
+        try:
+            result = await db.verify_and_settle(tx_hash, user_id, with_payment=with_payment)
+            if claimed:
+                await db.release_deposit_claim(tx_hash)
+            if result.status == db.SETTLE_COMPLETED:
+                logger.info("Deposit %s settled for user %s", tx_hash, user_id)
+                await db.deliver_access(result.user_id, result.months)
+            elif claimed and not (result.status == db.SETTLE_ALREADY_USED and result.owner_id == user_id):
+                # Пользователь ждёт ответа на присланный хэш (если депозит уже засчитан
+                # ему же повторной проверкой в answer_settlement - молчим)
+                await self.bot.send_message(user_id, settlement_reply(result))
+        except Exception as e:
+            logger.warning("Push settlement of %s for user %s failed: %s", tx_hash, user_id, e)
@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета исходящих запросов: меньше - важнее
+PAYMENT = 0  # подтверждения оплаты, выдача доступа
+INTERACTIVE = 1  # ответы на сообщения и кнопки (по умолчанию)
+BULK = 2  # чистка канала, рассылки
+LANE_NAMES = {PAYMENT: 'payment', INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+_current_lane = ContextVar('telegram_lane', default=INTERACTIVE)
+
+# Служебные методы не ждут в очереди (long polling не должен стоять за рассылкой)
+UNTHROTTLED_METHODS = {'GetUpdates', 'GetMe', 'SetWebhook', 'DeleteWebhook', 'GetWebhookInfo', 'Close', 'LogOut'}
+# Лимит на чат действует на отправку и правку сообщений, а не на ban/unban в канале
+PER_CHAT_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+
+
+@contextmanager
+def lane(priority):
+    # Все запросы к Telegram внутри блока (и в задачах, созданных в нём) идут в эту полосу
+    token = _current_lane.set(priority)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        # Через сколько секунд будет доступен токен
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class TelegramGateway(BaseRequestMiddleware):
+    # Все исходящие запросы бота проходят через общий token bucket (rate/с) и
+    # token bucket на чат для отправки сообщений. Ожидающие запросы выпускаются
+    # по приоритету полосы, внутри полосы - по очереди. RetryAfter ставит на паузу
+    # весь шлюз и повторяет запрос, а не превращается в ошибку хэндлера.
+
+    def __init__(self, rate=25, burst=25, chat_rate=1, chat_burst=3, max_retries=3, max_chats=10000):
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = {}  # chat_id -> TokenBucket
+        self._waiters = []  # (lane, seq, future)
+        self._seq = itertools.count()
+        self._depth = dict.fromkeys(LANE_NAMES, 0)
+        self._paused_until = 0.0
+        self._timer = None
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if name in UNTHROTTLED_METHODS:
+            return await make_request(bot, method)
+        priority = _current_lane.get()
+        chat_id = getattr(method, 'chat_id', None) if name.startswith(PER_CHAT_PREFIXES) else None
+        attempt = 0
+        while True:
+            await self._acquire(priority, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning("Flood limit on %s, pausing %ss (attempt %d)", name, e.retry_after, attempt)
+                if attempt > self.max_retries:
+                    raise
+
+    async def _acquire(self, priority, chat_id):
+        started = time.monotonic()
+        if chat_id is not None:
+            await self._acquire_chat(chat_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._set_depth(priority, 1)
+        self._release()
+        try:
+            await future
+        finally:
+            self._set_depth(priority, -1)
+            if future.cancelled():
+                # Отменённый ожидающий остаётся в куче и пропускается в _release
+                self._release()
+        metrics.TELEGRAM_QUEUE_WAIT.observe(time.monotonic() - started, LANE_NAMES[priority])
+
+    async def _acquire_chat(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._forget_idle_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        delay = bucket.delay(time.monotonic())
+        bucket.take(time.monotonic())  # токен резервируется сразу, очередь внутри чата по порядку
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.delay(now) == 0]:
+            del self._chats[chat_id]
+
+    def _set_depth(self, priority, change):
+        self._depth[priority] += change
+        metrics.TELEGRAM_QUEUE_DEPTH.set(self._depth[priority], LANE_NAMES[priority])
+
+    def _release(self):
+        # Выпускаем ожидающих, пока есть токены; иначе будим себя, когда токен появится
+        if self._timer is not None:
+            return
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            now = time.monotonic()
+            delay = max(self.bucket.delay(now), self._paused_until - now)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                return
+            self.bucket.take(now)
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._release()
@@ -0,0 +1,132 @@
+import sys
+from string import Template
+
+from plans import COINS, PLANS
+
+
+# Тексты экранов. Плейсхолдеры - $name, знак доллара пишется как $$.
+# Параметры тарифа/монеты подставляются один раз при загрузке,
+# при каждом колбэке заполняются только поля пользователя.
+SOURCES = {
+    'menu': "Here you can find useful information about premium subscriptions that you are looking for. Welcome! ⭐️",
+    'menu_hello': "Hello. Here you can find useful information about premium subscriptions that you are looking for. Welcome! ⭐️",
+    'menu_honey': "Hello,honey 😏. Here you can find useful information about premium subscriptions that you are looking for. Welcome! ⭐️",
+    'public_channel': "Public channel: https://t.me/wweuniverse00 \n",
+    'support': "If you read the FAQ and didn't find the answer to your question, you can personally DM me : https://t.me/actuallydone ",
+    'faq': " 1.<b> I always encounter low-quality videos. What’s the quality like on your channel? </b> \n Answer: All my videos are available in 1080p and above, so you don’t need to worry about quality. \n 2. <b>Why is there a cost for this content?</b> \n Answer: Many people can’t watch WWE on TV due to various reasons—work, health, etc. On my channel, you’ll find high-quality content, faster than anywhere else, ready for you to enjoy whenever you can. 😊 \n 3. <b>I don’t understand how to do something(pay,choose,etc.). What should I do?</b> \n Answer: Don't worry, just personally DM me and I will solve your issue. \n <b>But don't spam.</b> You will slow down the proccess. Think of others. \n 4. <b>If I accidentally made an incorrect payment, is there a refund?</b> \n Answer: If you paid to my crypto address but used the wrong network, it’s okay—we can sort it out. Also, if you used other payment methods, just DM me, and I’ll assist you ASAP. \n My contact: https://t.me/actuallydone ",
+    'plan': "<b> Premium access on $title </b>😈 \n ☀️ <b>Welcome</b>. This premium subscription will give you access to : \n \n - Previous WWE shows in HIGH quality 📸📸\n \n - Get content FASTER than everyone 💫💫 \n \n - Exclusive interviews from WWE superstars 😈🔥 \n \n - Interesting information about WWE superstars outside of the ring! \n <b>And so much more! Join US!</b> \n \n <b> Duration:</b> $days days \n <b> Price:</b> $price$$ \n \n <b> Choose your payment method: </b> \n",
+    'donation': " <b>Payment method:</b> 🌎 Donation Alerts \n <b>Cost:</b> $price$$ \n <b>Your ID:</b> $user_id \n 1. Head to the link below: https://www.donationalerts.com/r/wweuniverse69 . \n \n 2. Choose exact amount of $price$$. \n \n 3. In the message box, enter your ID that you see above. 👆 \n \n 4. Choose a convenient payment method for you. \n \n 5. After your donation this bot will provide you private channel link! ✅ \n \n Enjoy! ☀️ \n \n If need help: https://t.me/actuallydone \n",
+    'direct_intro': " <b>Payment method:</b> 🌎 Crypto: $coin \n <b>Cost:</b> $price$$ \n <b>Your ID:</b> $user_id \n <b>Payment address:</b> \n \n $coin: \n <pre>$address</pre> \n Make a payment using address above 👆 \n \n Once your payment is successful, click on the 'I paid' button and enter your transaction hash. It will automatically grant you access to the channel! \n \n Wait few minutes for transaction completion ✅ \n \n If need help: https://t.me/actuallydone \n",
+    'crypto_intro': "<b>Payment method:</b> 🌎 Crypto: $coin \n Your ID:<b> $user_id </b>, Cost: <b> $price$$ </b> \n To make a right deposit, you need to follow a few steps: \n 1. Press the button <b> 'Start payment' </b> \n 2. Copy amount of cryptocurrency. ⚠️<b> WARNING! </b> (You need to send EXACT amount or MORE. Be aware of fees. If you deposit via <b>wallet</b>, it's gonna be fee so be attentive! If you deposit via <b>exchange</b>, check the amount you are sending!) \n 3. $send_step \n 4. Once your transaction completed, simply press button <b> 'I paid' </b> and write your transaction hash. \n$note You will have 45 minutes to do this steps. \n IF something goes wrong, don't worry, just write me DM, i will help you ASAP. \n https://t.me/actuallydone",
+    'crypto_start': "<b>Payment method</b>: 🌎 Crypto: $coin\nYour ID: <b>$user_id </b>\nCost: $price$$\n<b>Address for payment:</b><pre>$address</pre>\n$memo<b>Crypto amount($currency)</b>: <pre>$crypto_amount</pre>\nPayment window ends: $window_end (<b>UTC</b>) (in 45 minutes)\n ",
+    'subscription_active': "<b>🎉 You have an active subscription! 👑</b>\n\n🗓️ <b>Subscription is valid until:</b> $end_date\n⚡️ <i>Enjoy your premium content!</i>",
+    'no_subscription': "⏳ <b>No subscription found.</b> \n Take a look at the subscriptions you can buy on the button below 👇\n",
+}
+
+# Ожидаемые плейсхолдеры каждого экрана (проверяются при загрузке)
+FIELDS = {
+    'plan': {'title', 'days', 'price'},
+    'donation': {'price', 'user_id'},
+    'direct_intro': {'coin', 'price', 'address', 'user_id'},
+    'crypto_intro': {'coin', 'price', 'send_step', 'note', 'user_id'},
+    'crypto_start': {'coin', 'price', 'address', 'memo', 'currency', 'user_id', 'crypto_amount', 'window_end'},
+    'subscription_active': {'end_date'},
+}
+
+
+class CompiledTemplate:
+    # Шаблон, разобранный один раз: кортеж литералов и имён полей
+
+    __slots__ = ('name', 'parts', 'fields', 'static')
+
+    def __init__(self, name, parts):
+        self.name = name
+        merged = []
+        for is_field, value in parts:
+            if not is_field and merged and not merged[-1][0]:
+                merged[-1] = (False, merged[-1][1] + value)
+            elif is_field or value:
+                merged.append((is_field, value))
+        self.parts = tuple((is_field, value if is_field else sys.intern(value)) for is_field, value in merged)
+        self.fields = frozenset(value for is_field, value in self.parts if is_field)
+        # Экран без полей пользователя отдаётся готовой строкой
+        if not self.parts:
+            self.static = ''
+        elif len(self.parts) == 1 and not self.parts[0][0]:
+            self.static = self.parts[0][1]
+        else:
+            self.static = None
+
+    @classmethod
+    def parse(cls, name, source, expected_fields=frozenset()):
+        parts = []
+        position = 0
+        for match in Template.pattern.finditer(source):
+            parts.append((False, source[position:match.start()]))
+            position = match.end()
+            if match.group('escaped') is not None:
+                parts.append((False, '$'))
+            elif match.group('named') or match.group('braced'):
+                parts.append((True, match.group('named') or match.group('braced')))
+            else:
+                raise ValueError(f"Template {name!r}: invalid placeholder at position {match.start('invalid')}")
+        parts.append((False, source[position:]))
+        template = cls(name, parts)
+        if template.fields != set(expected_fields):
+            raise ValueError(f"Template {name!r}: placeholders {sorted(template.fields)} do not match {sorted(expected_fields)}")
+        return template
+
+    def bind(self, **values):
+        # Подставляем статические параметры (тариф, монета), остальные поля остаются
+        parts = [(False, str(values[value])) if is_field and value in values else (is_field, value)
+                 for is_field, value in self.parts]
+        return CompiledTemplate(self.name, parts)
+
+    def render(self, **values):
+        if self.static is not None:
+            return self.static
+        return ''.join(str(values[value]) if is_field else value for is_field, value in self.parts)
+
+
+_screens = {}  # (name, variant) -> CompiledTemplate
+
+
+def _send_step(coin):
+    if coin.memo:
+        return "Copy address and <b>MEMO</b>, and send funds to it. ⚠️<b> WARNING! </b> (You need to copy <b>MEMO</b> and write it to correctly pass the payment.)"
+    return "Copy address and send funds to it."
+
+
+def load_templates():
+    compiled = {name: CompiledTemplate.parse(name, source, FIELDS.get(name, ())) for name, source in SOURCES.items()}
+    screens = {(name, None): template for name, template in compiled.items()}
+
+    for plan in PLANS.values():
+        screens[('plan', plan.months)] = compiled['plan'].bind(title=plan.title, days=plan.days, price=plan.price)
+        screens[('donation', plan.months)] = compiled['donation'].bind(price=plan.price)
+        for coin in COINS.values():
+            variant = (coin.currency, plan.months)
+            if coin.with_payment:
+                screens[('crypto_intro', variant)] = compiled['crypto_intro'].bind(
+                    coin=coin.name, price=plan.price, send_step=_send_step(coin),
+                    note=f" {coin.note}\n" if coin.note else "")
+                screens[('crypto_start', variant)] = compiled['crypto_start'].bind(
+                    coin=coin.name, price=plan.price, address=coin.address, currency=coin.currency,
+                    memo=f"⚠️ <b>MEMO:</b><pre>{coin.memo}</pre>\n" if coin.memo else "")
+            else:
+                screens[('direct_intro', variant)] = compiled['direct_intro'].bind(
+                    coin=coin.name, price=plan.price, address=coin.address)
+
+    _screens.clear()
+    _screens.update(screens)
+    return len(_screens)
+
+
+def screen(name, variant=None):
+    if not _screens:
+        load_templates()
+    return _screens[(name, variant)]
+
+
+def render(name, variant=None, **values):
+    return screen(name, variant).render(**values)
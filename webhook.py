@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    # Telegram получает ответ сразу, апдейт обрабатывается в фоне,
+    # но одновременно выполняется не больше max_concurrency хэндлеров
+
+    def __init__(self, dispatcher, bot, max_concurrency=64, **kwargs):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _background_feed_update(self, bot, update):
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+
+async def run_webhook(dp, bot, settings):
+    if not settings.webhook_secret:
+        raise ValueError("Webhook mode requires a secret token")
+
+    async def on_startup(bot):
+        if settings.webhook_set:
+            await bot.set_webhook(
+                f"{settings.webhook_url.rstrip('/')}{settings.webhook_path}",
+                secret_token=settings.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info("Webhook set to %s%s", settings.webhook_url, settings.webhook_path)
+
+    dp.startup.register(on_startup)
+
+    app = web.Application()
+    BoundedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        max_concurrency=settings.webhook_max_concurrency,
+        secret_token=settings.webhook_secret,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # reuse_port позволяет нескольким воркерам слушать один порт за reverse proxy
+    site = web.TCPSite(runner, settings.webapp_host, settings.webapp_port, reuse_port=settings.webapp_reuse_port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s", settings.webapp_host, settings.webapp_port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()